@@ -1,5 +1,9 @@
 
-address = 0x111000
+# BBs created during decompilation get addresses starting here, far above
+# the addresses of any real BB
+FIRST_ADDRESS = 0x111000
+
+address = FIRST_ADDRESS
 def get_new_address():
 	global address
 	result = address
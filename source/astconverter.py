@@ -2,6 +2,7 @@ import utils
 import absyn
 import expr
 import hlir
+import settings
 
 class Converter:
 	def __init__(self, contract, loops, follows, constructor_ast):
@@ -36,6 +37,12 @@ class Converter:
 	def visit_nodes(self, f, func):
 		for node in f.nodes():
 			func(node)
+			if settings.check_level == settings.CHECKS_FULL:
+				self.sanity_checks(f)
+
+		# the AST has no mutation journal, so incremental checking means
+		# checking once per transformation rather than once per node
+		if settings.check_level == settings.CHECKS_INCREMENTAL:
 			self.sanity_checks(f)
 	
 	def remove_direct_jumps(self, node):
@@ -306,7 +313,8 @@ class Converter:
 			self.fix_loops(f)
 			self.visit_nodes(f, self.remove_follow_edges)
 
-			self.sanity_checks(f)
+			if settings.check_level != settings.CHECKS_OFF:
+				self.sanity_checks(f)
 
 		for f in funcs:
 			self.fix_locations(f, conv)
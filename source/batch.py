@@ -0,0 +1,281 @@
+import os
+import sys
+import glob
+import json
+import time
+import signal
+import traceback
+import multiprocessing
+import StringIO
+
+import utils
+import cache
+import decompiler
+
+DEFAULT_TIMEOUT = 180
+
+CONTRACT_EXTENSIONS = (".bc", ".json")
+
+"""
+One JSON record is written per line of the output:
+
+record {
+
+	filename: "foo.bc",
+
+	running_time: 123,
+
+	cached: false,  (only present when a result cache is used)
+
+	log: "Warning: ...",  (only present if anything was printed)
+
+	success {
+		... (see make_success_record)
+	}
+
+	OR:
+
+	failure {
+		error: "blabla",
+	}
+
+}
+
+"""
+
+
+class TimeoutException(Exception):
+	pass
+
+def is_contract_file(filename):
+	return filename.endswith(CONTRACT_EXTENSIONS)
+
+def read_manifest(filename):
+	# a manifest is a text file listing one contract per line;
+	# relative paths are relative to the manifest itself
+	base = os.path.dirname(filename)
+
+	result = []
+	for line in utils.read_file_contents(filename).splitlines():
+		line = line.strip()
+		if not line or line.startswith("#"):
+			continue
+		result.append(os.path.join(base, line))
+	return result
+
+def collect_files(inputs):
+	# each input is a directory, a glob pattern, a manifest or a single
+	# contract file
+	result = []
+	for inp in inputs:
+		if os.path.isdir(inp):
+			for dirpath, dirnames, filenames in os.walk(inp):
+				dirnames.sort()
+				for name in sorted(filenames):
+					if is_contract_file(name):
+						result.append(os.path.join(dirpath, name))
+		elif os.path.isfile(inp):
+			if is_contract_file(inp):
+				result.append(inp)
+			else:
+				result += read_manifest(inp)
+		else:
+			matches = sorted(glob.glob(inp))
+			if len(matches) == 0:
+				raise ValueError("No contracts found for input: %s" % inp)
+			result += [m for m in matches if os.path.isfile(m)]
+
+	# keep the first occurrence of every file
+	seen = set()
+	unique = []
+	for filename in result:
+		if filename in seen:
+			continue
+		seen.add(filename)
+		unique.append(filename)
+	return unique
+
+def read_bytecode(filename):
+	if filename.endswith(".json"):
+		bytecode, _ = utils.parse_json(filename)
+		return bytecode
+
+	contents = utils.read_file_contents(filename)
+	return utils.decode_bytecode(contents)
+
+def make_success_record(stats, code):
+	# stats are the Decompiler's json_stats
+	complexities = stats["func_complexities"]
+	funcs_with_gotos = stats["funcs_with_gotos"]
+
+	success = {}
+	success["num_funcs"] = len(complexities)
+	success["num_gotos"] = stats["num_gotos"]
+	success["num_funcs_with_gotos"] = len(funcs_with_gotos)
+
+	goto_func_complexities = []
+	other_func_complexities = []
+	for f in sorted(complexities):
+		if f in funcs_with_gotos:
+			goto_func_complexities.append(complexities[f])
+		else:
+			other_func_complexities.append(complexities[f])
+
+	success["goto_func_complexities"] = goto_func_complexities
+	success["other_func_complexities"] = other_func_complexities
+
+	success["num_evm_instrs"] = stats["num_evm_instrs"]
+
+	# per-phase timings and counters, see instrumentation.py
+	success["phases"] = stats.get("phases", [])
+
+	success["output"] = code
+
+	return success
+
+
+# these are set in every worker process by init_worker
+worker_timeout = DEFAULT_TIMEOUT
+worker_cache = None
+
+def alarm_handler(signum, frame):
+	raise TimeoutException("timeout after %d seconds" % worker_timeout)
+
+def init_worker(timeout, cache_dir):
+	global worker_timeout, worker_cache
+	worker_timeout = timeout
+	if cache_dir is not None:
+		worker_cache = cache.ResultCache(cache_dir, decompiler.PIPELINE_VERSION)
+
+	# let the parent process deal with ctrl-c
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGALRM, alarm_handler)
+
+def decompile_file(filename):
+	record = {"filename": filename}
+
+	# warnings are printed to stdout, which would garble the output of
+	# the batch run, so they are kept with the record instead
+	captured = StringIO.StringIO()
+	orig_stdout = sys.stdout
+	sys.stdout = captured
+
+	begin = time.time()
+	try:
+		if worker_timeout:
+			signal.alarm(worker_timeout)
+
+		bytecode = read_bytecode(filename)
+		d = decompiler.Decompiler()
+		if worker_cache is not None:
+			code, record["cached"] = d.decompile_cached(bytecode, worker_cache)
+			stats = d.stats
+		else:
+			contract, ast, code = d.decompile(bytecode)
+			stats = d.json_stats(ast)
+
+		signal.alarm(0)
+		record["success"] = make_success_record(stats, code)
+
+	except TimeoutException as e:
+		signal.alarm(0)
+		record["failure"] = {"error": str(e)}
+
+	except Exception as e:
+		signal.alarm(0)
+		record["failure"] = {"error": traceback.format_exc()}
+
+	finally:
+		sys.stdout = orig_stdout
+
+	record["running_time"] = time.time() - begin
+
+	log_output = captured.getvalue()
+	if log_output:
+		record["log"] = log_output
+
+	return record
+
+def run(filenames, out, jobs=None, timeout=DEFAULT_TIMEOUT, cache_dir=None):
+	if jobs is None:
+		jobs = multiprocessing.cpu_count()
+
+	num_success, num_failure = 0, 0
+
+	# workers are reused across jobs so that the interpreter startup and
+	# import cost is only paid once per worker
+	pool = multiprocessing.Pool(jobs, init_worker, (timeout, cache_dir))
+	try:
+		for record in pool.imap_unordered(decompile_file, filenames, 1):
+			out.write(json.dumps(record) + "\n")
+			out.flush()
+
+			if "success" in record:
+				num_success += 1
+			else:
+				num_failure += 1
+
+		pool.close()
+	except KeyboardInterrupt:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
+
+	return num_success, num_failure
+
+def usage():
+	print("Usage: %s batch [-j <jobs>] [-t <timeout>] [-o <output.jsonl>] "
+		"[-c <cache directory>] "
+		"<directory|glob|manifest|file>..." % sys.argv[0])
+
+def main(args):
+	jobs = None
+	timeout = DEFAULT_TIMEOUT
+	out_filename = None
+	cache_dir = None
+	inputs = []
+
+	i = 0
+	while i < len(args):
+		arg = args[i]
+		if arg in ("-j", "-t", "-o", "-c"):
+			if i + 1 >= len(args):
+				usage()
+				return 1
+			value = args[i+1]
+			if arg == "-j":
+				jobs = int(value)
+			elif arg == "-t":
+				timeout = int(value)
+			elif arg == "-o":
+				out_filename = value
+			else:
+				cache_dir = value
+			i += 2
+			continue
+		inputs.append(arg)
+		i += 1
+
+	if len(inputs) == 0:
+		usage()
+		return 1
+
+	filenames = collect_files(inputs)
+
+	if out_filename is None:
+		out = sys.stdout
+	else:
+		out = open(out_filename, "w")
+
+	before = time.time()
+	try:
+		num_success, num_failure = run(filenames, out, jobs, timeout, cache_dir)
+	finally:
+		if out is not sys.stdout:
+			out.close()
+
+	sys.stderr.write("Decompiled %d contracts (%d failed) in %f seconds\n" % (
+		num_success + num_failure, num_failure, time.time() - before))
+
+	return 0
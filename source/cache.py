@@ -0,0 +1,175 @@
+import os
+import json
+import errno
+import fcntl
+import hashlib
+import tempfile
+
+import utils
+import settings
+
+# the settings which change the decompiled code, and so are part of the key
+OUTPUT_SETTINGS = [
+	"value_numbering",
+	"simplify_bbs",
+	"simplify_free_mem_ptr",
+	"pretty_ast",
+	"show_unusedvalue_assignments",
+]
+
+DEFAULT_MAX_SIZE = 1 << 30
+
+# once the cache grows beyond its maximum size, old entries are removed
+# until it is below this fraction of the maximum
+EVICTION_WATERMARK = 0.9
+
+# how many insertions a process makes between checks of the cache size
+EVICTION_INTERVAL = 64
+
+ENTRY_SUFFIX = ".json"
+
+class ResultCache:
+	# a content-addressed on-disk cache of decompilation results.
+	#
+	# entries are stored as <directory>/<key[:2]>/<key>.json. They are
+	# written to a temporary file and then renamed into place, so readers
+	# never see partial entries, even with several processes sharing the
+	# cache. An entry's mtime is refreshed on every hit and eviction removes
+	# the least recently used entries first.
+
+	def __init__(self, directory, version, max_size=DEFAULT_MAX_SIZE):
+		self.directory = directory
+		self.version = str(version)
+		self.max_size = max_size
+		self.num_puts = 0
+
+		self.hits = 0
+		self.misses = 0
+
+		make_dirs(directory)
+
+	def make_key(self, bytecode):
+		# the swarm hash does not affect the decompiled code, so clones that
+		# only differ in their metadata share an entry
+		h = hashlib.sha256()
+		h.update(self.version)
+		h.update("\x00")
+		for name in OUTPUT_SETTINGS:
+			h.update("%s=%r\x00" % (name, getattr(settings, name)))
+		h.update(utils.remove_swarm_hash(bytecode))
+		return h.hexdigest()
+
+	def entry_path(self, key):
+		return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+	def get(self, key):
+		path = self.entry_path(key)
+		try:
+			with open(path) as f:
+				entry = json.load(f)
+		except (IOError, OSError):
+			self.misses += 1
+			return None
+		except ValueError:
+			# should not happen since entries are renamed into place, but
+			# a corrupt entry must never be returned
+			remove_file(path)
+			self.misses += 1
+			return None
+
+		if entry.get("key") != key or entry.get("version") != self.version:
+			self.misses += 1
+			return None
+
+		# mark the entry as recently used
+		try:
+			os.utime(path, None)
+		except OSError:
+			pass
+
+		self.hits += 1
+		return entry["result"]
+
+	def put(self, key, result):
+		path = self.entry_path(key)
+		shard = os.path.dirname(path)
+		make_dirs(shard)
+
+		entry = {
+			"key": key,
+			"version": self.version,
+			"result": result,
+		}
+
+		fd, tmp_path = tempfile.mkstemp(dir=shard, prefix=".tmp-")
+		try:
+			with os.fdopen(fd, "w") as f:
+				json.dump(entry, f)
+			os.rename(tmp_path, path)
+		except:
+			remove_file(tmp_path)
+			raise
+
+		self.num_puts += 1
+		if self.num_puts % EVICTION_INTERVAL == 1:
+			self.evict()
+
+	def entries(self):
+		result = []
+		for shard in os.listdir(self.directory):
+			shard_path = os.path.join(self.directory, shard)
+			if not os.path.isdir(shard_path):
+				continue
+
+			for name in os.listdir(shard_path):
+				if not name.endswith(ENTRY_SUFFIX):
+					continue
+				path = os.path.join(shard_path, name)
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				result.append((st.st_mtime, st.st_size, path))
+		return result
+
+	def evict(self):
+		# only one process evicts at a time; the others just skip it
+		lock = open(os.path.join(self.directory, "lock"), "w")
+		try:
+			try:
+				fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except IOError as e:
+				if e.errno in (errno.EAGAIN, errno.EACCES):
+					return 0
+				raise
+
+			entries = self.entries()
+			total_size = sum(size for _, size, _ in entries)
+			if total_size <= self.max_size:
+				return 0
+
+			target = self.max_size * EVICTION_WATERMARK
+			num_removed = 0
+			for mtime, size, path in sorted(entries):
+				if total_size <= target:
+					break
+				remove_file(path)
+				total_size -= size
+				num_removed += 1
+
+			return num_removed
+		finally:
+			lock.close()
+
+def make_dirs(directory):
+	try:
+		os.makedirs(directory)
+	except OSError as e:
+		if e.errno != errno.EEXIST:
+			raise
+
+def remove_file(path):
+	try:
+		os.remove(path)
+	except OSError:
+		pass
@@ -3,6 +3,8 @@ import expr
 import utils
 import numbering
 import draw
+import dominance
+import settings
 
 MAX_ITERATIONS = 20
 
@@ -127,40 +129,39 @@ class LoopStructuring:
 		header_nodes.append(g.header_node)
 
 		for h in header_nodes:
-			# compute the interval with h as a header node
+			# compute the interval with h as a header node. A node is added
+			# once all its predecessors are in the interval, which we track
+			# by counting them.
 			interval_nodes = [h]
-
-			# add nodes to the interval while possible
-			while True:
-				progress = False
-				for m in list(remaining_nodes):
-					assert (m not in interval_nodes)
-					assert (len(g.predecessors[m]) != 0)
-					if all(p in interval_nodes for p in g.predecessors[m]):
+			preds_in_interval = {}
+
+			# nodes which the interval goes to, but which may not be in it
+			entered_nodes = []
+
+			i = 0
+			while i < len(interval_nodes):
+				n = interval_nodes[i]
+				i += 1
+				for m in g.successors[n]:
+					if m not in remaining_nodes:
+						continue
+					count = preds_in_interval.get(m, 0) + 1
+					preds_in_interval[m] = count
+					if count == len(g.predecessors[m]):
 						remaining_nodes.remove(m)
 						interval_nodes.append(m)
-						progress = True
-
-				if not progress:
-					break
+					elif count == 1:
+						entered_nodes.append(m)
 
 			# add it to the intervals set
 			intervals.append(interval_nodes)
 
-			# compute more header nodes to process
-			for m in list(remaining_nodes):
-				assert (m not in header_nodes)
-				assert (m not in interval_nodes)
-				if any(p in interval_nodes for p in g.predecessors[m]):
+			# the nodes the interval goes to are the next header nodes
+			for m in entered_nodes:
+				if m in remaining_nodes:
 					remaining_nodes.remove(m)
 					header_nodes.append(m)
 
-					# every predecessor should not be in the interval,
-					# otherwise this node should have been included in the
-					# interval too
-					assert (not all(p in interval_nodes 
-									for p in g.predecessors[m]))
-
 		return intervals
 	
 	def find_latching_nodes(self, interval):
@@ -182,13 +183,25 @@ class LoopStructuring:
 			loop_bbs
 		)
 
-		self.sanity_check_loop(loop)
+		if settings.check_level == settings.CHECKS_FULL:
+			self.sanity_check_loop(loop)
 		self.found_loops.add(loop)
 	
-	# check a condition: there must exist 
-	def satisfies_condition(self, node, latching_nodes):
-		reachable = node.reachable_nodes()
-		return any(l in reachable for l in latching_nodes)
+	# the nodes which can reach a latching node. Every latching node goes to
+	# the header, and the header reaches every node of the interval, so
+	# these are the nodes which reach the header. That takes a single walk
+	# backwards rather than one walk forwards per node.
+	def nodes_reaching_latching_nodes(self, interval):
+		header = interval[0]
+		result = set([header])
+		stack = list(header.get_predecessors())
+		while len(stack) != 0:
+			node = stack.pop()
+			if node in result:
+				continue
+			result.add(node)
+			stack.extend(node.get_predecessors())
+		return result
 	
 	# attempts to create a loop, though it may fail.
 	def make_loop_from_interval(self, interval):
@@ -207,9 +220,12 @@ class LoopStructuring:
 		max_latching_node = max(latching_nodes, key=lambda n: number[n])
 		assert (number[header_node] <= number[max_latching_node])
 
+		reaching = self.nodes_reaching_latching_nodes(interval)
 		loop_nodes = [n for n in interval if number[n] >= number[header_node]
 						and number[n] <= number[max_latching_node]
-						and self.satisfies_condition(n, latching_nodes)]
+						and n in reaching]
+		loop_set = set(loop_nodes)
+		interval_set = set(interval)
 
 		# don't make loops with indirect jumps in them
 		for node in loop_nodes:
@@ -221,7 +237,7 @@ class LoopStructuring:
 			out_reachable = set()
 			for node in loop_nodes:
 				for s in node.get_successors():
-					if s not in loop_nodes:
+					if s not in loop_set:
 						out_reachable.add(s)
 
 			if len(out_reachable) == 0:
@@ -246,10 +262,11 @@ class LoopStructuring:
 						return
 
 			for node in out_reachable:
-				if all(p in loop_nodes for p in node.get_predecessors()):
-					if node in interval:
+				if all(p in loop_set for p in node.get_predecessors()):
+					if node in interval_set:
 						# we can pull it in
 						loop_nodes.append(node)
+						loop_set.add(node)
 						break
 			else:
 				# found no node to pull in.
@@ -264,10 +281,10 @@ class LoopStructuring:
 
 			# can't escape the loop except via follow
 			for s in node.get_successors():
-				assert (s in loop_nodes or s in [header_node, follow_node])
+				assert (s in loop_set or s in [header_node, follow_node])
 
 			# all loop nodes are in this interval
-			assert (node in interval)
+			assert (node in interval_set)
 			
 		self.make_loop(header_node, follow_node, loop_nodes)
 
@@ -275,20 +292,13 @@ class LoopStructuring:
 	# that every cycle goes through the interval header
 	def sanity_check_intervals(self, intervals, g):
 		# none of the intervals should overlap
-		for interval in intervals:
-			i = set(interval)
-			for other in intervals:
-				o = set(other)
-				if i == o:
-					continue
-
-				assert (len(i & o) == 0)
-
-		# every node in the graph should be in some interval
 		covered_nodes = set()
 		for interval in intervals:
 			for node in interval:
+				assert (node not in covered_nodes)
 				covered_nodes.add(node)
+
+		# every node in the graph should be in some interval
 		for node in g.nodes():
 			assert (node in covered_nodes)
 
@@ -404,9 +414,10 @@ class LoopStructuring:
 		g = self.make_initial_graph()
 		iterations = 0
 		while g.is_reducible():
-			self.sanity_check_graph(g)
 			intervals = self.find_intervals(g)
-			self.sanity_check_intervals(intervals, g)
+			if settings.check_level == settings.CHECKS_FULL:
+				self.sanity_check_graph(g)
+				self.sanity_check_intervals(intervals, g)
 			for interval in intervals:
 				# may fail silently.
 				self.make_loop_from_interval(interval)
@@ -549,9 +560,40 @@ class ConditionalFollowDiscoverer:
 		# this would make no sense
 		assert (node != follow)
 	
+	def compute_post_dominators(self, function):
+		# the post-dominators on the filtered graph, rooted at every node so
+		# that the nodes inside loops, which the filtered graph only enters
+		# through their header, are included.
+		# the successors() of a jcond's pass also skip the edges back into
+		# the jcond itself, but paths to an exit which go around such an
+		# edge have a suffix which doesn't, so the immediate post-dominator
+		# of the jcond is the same on this graph.
+		self.current_header = None
+		return dominance.post_dominator_tree(list(function.nodes()),
+											 self.successors)
+
+	def follow_from_reachability(self, node, true_node, false_node):
+		# the first node, in the order of the NumberComputer, which both
+		# sides of the conditional reach.
+		# returns False if the conditional shouldn't be structured.
+		true_reach = true_node._reachable_nodes(self.successors)
+		false_reach = false_node._reachable_nodes(self.successors)
+
+		if node in true_reach or node in false_reach:
+			return False
+
+		intersection = true_reach & false_reach
+		if len(intersection) == 0:
+			return None
+
+		nc = numbering.NumberComputer(list(intersection), self.successors)
+		nc.compute_bb_numbering()
+		return min(intersection, key=lambda n: nc.numbering[n])
+
 	def discover_follow_in_func(self, function):
 		follows = {}
-		bbs_by_addr = {bb.address: bb for bb in function.nodes()}
+		bbs_by_addr = function.get_nodes_by_addr()
+		post_dominators = self.compute_post_dominators(function)
 		for node in reversed(utils.dfs_ordering(function.header_node)):
 			ins = node.terminator
 			if ins.type != hlir.ins_types.jcond:
@@ -576,33 +618,28 @@ class ConditionalFollowDiscoverer:
 				true_node, false_node = false_node, true_node
 			assert (true_node == bbs_by_addr[ins.loc.literal])
 
-			true_reach = true_node._reachable_nodes(self.successors)
-			false_reach = false_node._reachable_nodes(self.successors)
-
-			if node in true_reach or node in false_reach:
-				continue
-
-			intersection = true_reach & false_reach
-			if len(intersection) == 0:
-				# we can't find a traditional follow -- but if one of the
-				# sides returns early then we can still make the conditional
-				# look better
-				# however we should ensure that the follow node doesn't have other
-				# predecessors, otherwise the generated code may actually get
-				# worse from this.
-				if self.is_end_point(true_node):
-					follow = false_node
-
-				elif self.is_end_point(false_node):
-					follow = true_node
+			# we can't find a traditional follow if one of the sides returns
+			# early -- but then we can still make the conditional look
+			# better.
+			# however we should ensure that the follow node doesn't have other
+			# predecessors, otherwise the generated code may actually get
+			# worse from this.
+			if self.is_end_point(true_node):
+				follow = false_node
 
-				else:
-					follow = None
+			elif self.is_end_point(false_node):
+				follow = true_node
 
 			else:
-				nc = numbering.NumberComputer(list(intersection), self.successors)
-				nc.compute_bb_numbering()
-				follow = min(intersection, key=lambda n: nc.numbering[n])
+				# usually both sides meet again at the immediate
+				# post-dominator. If they don't, e.g. since one side may
+				# return early, there still may be nodes they both reach.
+				follow = post_dominators.immediate(node)
+				if follow is None:
+					follow = self.follow_from_reachability(
+						node, true_node, false_node)
+					if follow is False:
+						continue
 
 			self.sanity_check(node, true_node, false_node, follow)
 			if follow:
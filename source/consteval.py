@@ -0,0 +1,96 @@
+import expr
+import utils
+
+# evaluation of operations on constants, for constant folding and other
+# static analyses.
+#
+# this works on plain ints rather than going through expr.evaluate and
+# interpreter.Value, and follows the EVM semantics:
+# - all results are wrapped modulo 2**256
+# - division and modulo by zero yield 0
+# - signed division truncates towards zero, and -2**255 / -1 == -2**255
+# - comparisons yield 1 or 0
+#
+# operands are wrapped before they are used, so that literals which went out
+# of range (e.g. negative ones) are treated like the EVM would treat them.
+# Results which fit are returned as ints rather than longs, since the
+# interpreter expects e.g. memory offsets to be ints.
+
+MOD = 2**256
+MASK = MOD - 1
+
+def wrap(value):
+	return value & MASK
+
+def div(a, b):
+	if b == 0:
+		return 0
+	return a // b
+
+def sdiv(a, b):
+	a, b = utils.signed(a), utils.signed(b)
+	if b == 0:
+		return 0
+	result = abs(a) // abs(b)
+	if (a < 0) != (b < 0):
+		result = -result
+	return wrap(result)
+
+def mod(a, b):
+	if b == 0:
+		return 0
+	return a % b
+
+def sign_extend(nbytes, value):
+	if nbytes >= 31:
+		return value
+	nbits = 8*(nbytes+1) # +1 since it starts at 0
+	return wrap(utils.extend(value, nbits))
+
+binary_ops = {
+	expr.Add: lambda a, b: wrap(a + b),
+	expr.Sub: lambda a, b: wrap(a - b),
+	expr.Mul: lambda a, b: wrap(a * b),
+	expr.Div: div,
+	expr.SDiv: sdiv,
+	expr.Mod: mod,
+	expr.Exp: lambda a, b: pow(a, b, MOD),
+	expr.And: lambda a, b: a & b,
+	expr.Or: lambda a, b: a | b,
+	expr.Xor: lambda a, b: a ^ b,
+	expr.Eq: lambda a, b: int(a == b),
+	expr.Lt: lambda a, b: int(a < b),
+	expr.Gt: lambda a, b: int(a > b),
+	expr.SLt: lambda a, b: int(utils.signed(a) < utils.signed(b)),
+	expr.SGt: lambda a, b: int(utils.signed(a) > utils.signed(b)),
+	expr.SignExtend: sign_extend,
+}
+
+unary_ops = {
+	expr.Not: lambda a: int(a == 0),
+	expr.Neg: lambda a: utils.neg(a, 256),
+}
+
+def evaluate_binary(cls, a, b):
+	# returns None if the operation can't be evaluated
+	op = binary_ops.get(cls)
+	if op is None:
+		return None
+	return int(op(wrap(a), wrap(b)))
+
+def evaluate_unary(cls, a):
+	op = unary_ops.get(cls)
+	if op is None:
+		return None
+	return int(op(wrap(a)))
+
+def fold(node):
+	# the value of a binary or unary op on literals, or None
+	if isinstance(node, expr.BinaryOp):
+		a, b = node.operand1, node.operand2
+		if isinstance(a, expr.Lit) and isinstance(b, expr.Lit):
+			return evaluate_binary(node.__class__, a.literal, b.literal)
+	elif isinstance(node, expr.UnaryOp):
+		if isinstance(node.operand, expr.Lit):
+			return evaluate_unary(node.__class__, node.operand.literal)
+	return None
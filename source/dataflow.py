@@ -2,8 +2,13 @@ import expr
 import hlir
 import utils
 import vmcall
+import memalias
+import settings
+import collections
+
+class ProgramPoint(object):
+	__slots__ = ("node", "ins")
 
-class ProgramPoint:
 	def __init__(self, node, ins):
 		self.node = node
 		self.ins = ins
@@ -19,7 +24,7 @@ class Def:
 		return self.point.ins == o.point.ins and self.point.node == o.point.node
 	
 	def __hash__(self):
-		return hash(self.point.node)
+		return hash((self.point.node, self.point.ins))
 	
 	def __str__(self):
 		return "def of %s: %s" % (str(self.var), str(self.point))
@@ -124,14 +129,7 @@ def ids_may_be_equal(id1, id2, same_bb=False):
 				and id2.address.is_free_mem_ptr()):
 			return False
 
-		if all(isinstance(e, expr.Lit) 
-			   for e in [id1.address, id1.length, id2.address, id2.length]):
-			r1 = range(id1.address.literal, id1.address.literal + id1.length.literal)
-			r2 = range(id2.address.literal, id2.address.literal + id2.length.literal)
-			intersection = set(r1) & set(r2)
-			return len(intersection) != 0
-
-		return True
+		return memalias.may_alias(id1, id2, same_bb)
 	
 	elif isinstance(id1, expr.NamedStorageAccess):
 		if id1.num != id2.num:
@@ -163,7 +161,8 @@ def ids_may_be_equal(id1, id2, same_bb=False):
 		print(id2)
 		assert (False)
 
-def get_certain_definitions(ident, use_point):
+def get_certain_definitions(ident, use_point, visited=None):
+	# if visited is given, the nodes the answer depends on are added to it
 	paths = []
 	defs = {}
 
@@ -194,6 +193,9 @@ def get_certain_definitions(ident, use_point):
 		explorer.explore()
 	except ExplorationFailedException:
 		return None
+	finally:
+		if visited is not None:
+			visited |= explorer.visited
 
 	return paths, defs
 
@@ -252,6 +254,10 @@ class DefUseExplorer:
 		self.steps = 0
 		self.next_nodes = None
 
+		# every node whose instructions or edges the exploration looked at.
+		# The outcome can only change if one of them changes.
+		self.visited = set()
+
 		if uses_cache:
 			self.uses_cache = uses_cache
 		else:
@@ -303,14 +309,7 @@ class DefUseExplorer:
 	
 	def get_uses(self, ins):
 		if id(ins) not in self.uses_cache:
-			# collect the uses
-			used_ids = []
-			def collect(e):
-				if isinstance(e, expr.Id):
-					used_ids.append(e)
-				return e
-			utils.visit_and_modify_instruction(ins, collect, exclude_lhs=True)
-			self.uses_cache[id(ins)] = used_ids
+			self.uses_cache[id(ins)] = get_uses(ins)
 
 		return self.uses_cache[id(ins)]
 	
@@ -425,6 +424,7 @@ class DefUseExplorer:
 			# check against cycles
 			if node in seen:
 				continue
+			self.visited.add(node)
 
 			# this can happen sometimes while we're walking backwards and
 			# predecessors haven't been updated yet
@@ -469,3 +469,446 @@ class DefUseExplorer:
 				args = (next_node, seen, new_sp_offset)
 				stack.append(args)
 
+
+
+# The explorer above enumerates paths for every single query, which is
+# exponential in the worst case and has to give up after MAX_STEPS. What
+# follows is a classic iterative dataflow framework instead: reaching
+# definitions and liveness are computed once per function, for all variables
+# and stack slots at once, and queries are answered from the resulting
+# tables.
+#
+# stack slots are numbered by their absolute offset, which is only possible
+# if every node has a single stack height. Functions where that isn't the
+# case (or which still contain indirect jumps, across which the explorer
+# loses track of the stack) are left to the explorer for stack queries.
+
+def compute_stack_heights(f):
+	# returns a map from node to the stack height at the end of the node,
+	# relative to the end of the header, such that stack[sp+x] in node n is
+	# the same slot as stack[sp+y] in node m exactly when
+	# x + heights[n] == y + heights[m].
+	# Returns None if there is no such map, e.g. because a code block is
+	# shared by callers at different stack heights.
+	nodes = f.nodes()
+	heights = {f.header_node: 0}
+	stack = [f.header_node]
+	while len(stack) != 0:
+		node = stack.pop()
+		if utils.has_imprecise_successors(node):
+			return None
+
+		for succ in node.get_successors():
+			if succ not in nodes:
+				continue
+			height = heights[node] + succ.sp_delta
+			if succ not in heights:
+				heights[succ] = height
+				stack.append(succ)
+			elif heights[succ] != height:
+				return None
+	return heights
+
+def solve_union(nodes, flows_from, gen, kill, boundary):
+	# a worklist solver for bit-vector problems whose meet operator is
+	# union. flows_from[n] are the nodes whose output flows into n, and
+	# nodes should be ordered such that they mostly come first. Bit-vectors
+	# are plain ints. Returns the maps of input and output vectors.
+	flows_to = {n: [] for n in nodes}
+	for n in nodes:
+		for m in flows_from[n]:
+			flows_to[m].append(n)
+
+	inputs = {}
+	outputs = dict.fromkeys(nodes, 0)
+
+	worklist = collections.deque(nodes)
+	queued = set(nodes)
+	while len(worklist) != 0:
+		n = worklist.popleft()
+		queued.discard(n)
+
+		value = boundary.get(n, 0)
+		for m in flows_from[n]:
+			value |= outputs[m]
+		inputs[n] = value
+
+		out = gen[n] | (value & ~kill[n])
+		if out == outputs[n]:
+			continue
+		outputs[n] = out
+
+		for m in flows_to[n]:
+			if m not in queued:
+				queued.add(m)
+				worklist.append(m)
+
+	return inputs, outputs
+
+def get_uses(ins):
+	used_ids = []
+	def collect(e):
+		if isinstance(e, expr.Id):
+			used_ids.append(e)
+	utils.visit_instruction(ins, collect, exclude_lhs=True)
+	return used_ids
+
+def get_instrs(node):
+	return node.get_instructions() + [node.terminator]
+
+class FunctionDataflow:
+	# reaching definitions and liveness of the variables and stack slots of
+	# a function. The tables describe the function as it was when they were
+	# last refreshed. Removing dead definitions or replacing uses keeps them
+	# sound, since that only makes fewer definitions reach and fewer
+	# locations live.
+	#
+	# an instance is kept with its function for as long as the function
+	# lives (see get_dataflow). Refreshing it only revisits the instructions
+	# of the nodes which the function's journal says changed; the bit-vector
+	# problems themselves are cheap to solve again.
+	#
+	# it also remembers questions which could not be answered positively
+	# and were expensive to ask (see add_negative), so that passes don't
+	# explore the same unchanged part of the function on every round.
+
+	def __init__(self, f):
+		self.function = f
+		self.clock = None
+		self.heights = None
+		self.preds = {}
+
+		# node -> [(ins, used ids)]
+		self.summaries = {}
+
+		# key -> (clock, nodes the answer depends on, referenced objects)
+		self.negatives = {}
+
+		self.refresh()
+
+	def summarize(self, node):
+		return [(ins, get_uses(ins)) for ins in get_instrs(node)]
+
+	def refresh(self):
+		f = self.function
+		if self.clock == f.clock:
+			return
+		changed = None
+		if self.clock is not None:
+			changed = f.modified_since(self.clock)
+
+		self.clock = f.clock
+
+		old_nodes = set(self.preds)
+		self.nodes = utils.dfs_ordering(f.header_node)
+		node_set = set(self.nodes)
+		self.preds = {n: [p for p in n.get_predecessors() if p in node_set]
+					  for n in self.nodes}
+		self.succs = {n: [s for s in n.get_successors() if s in node_set]
+					  for n in self.nodes}
+
+		old_heights = self.heights
+		self.heights = compute_stack_heights(f)
+
+		# the negative answers are dropped if the answers may now come from
+		# a different analysis, or a node joined the function: it was a
+		# predecessor of the function's nodes all along, so that doesn't
+		# show up in the journal
+		if (changed is None or not node_set <= old_nodes
+				or (old_heights is None) != (self.heights is None)):
+			self.negatives = {}
+
+		summaries = {}
+		for node in self.nodes:
+			if (changed is None or node in changed 
+					or node not in self.summaries):
+				summaries[node] = self.summarize(node)
+				continue
+
+			summary = self.summaries[node]
+			if settings.check_level == settings.CHECKS_FULL:
+				# the node must really be unchanged, or the journal missed
+				# a mutation
+				fresh = self.summarize(node)
+				assert (len(fresh) == len(summary))
+				for (ins1, uses1), (ins2, uses2) in zip(fresh, summary):
+					assert (ins1 is ins2)
+					assert (len(uses1) == len(uses2))
+					assert (all(u1 is u2 for u1, u2 in zip(uses1, uses2)))
+			summaries[node] = summary
+		self.summaries = summaries
+
+		self.uses = {} # id(ins) -> used ids
+		for summary in summaries.values():
+			for ins, uses in summary:
+				self.uses[id(ins)] = uses
+
+		# location -> bit index; a location is a Var or ("stack", slot)
+		self.locations = {}
+
+		self.compute_reaching_definitions()
+		self.compute_liveness()
+
+	def add_negative(self, key, region, refs):
+		# remembers that the question identified by key had a negative
+		# answer, which only depends on the given nodes. refs are the
+		# objects whose ids make up the key; holding on to them keeps the
+		# ids from being reused.
+		self.negatives[key] = (self.function.clock, region, refs)
+
+	def known_negative(self, key):
+		# whether the question identified by key is known to still have a
+		# negative answer
+		entry = self.negatives.get(key)
+		if entry is None:
+			return False
+
+		clock, region, _ = entry
+		f = self.function
+		if f.all_modified <= clock:
+			for node in region:
+				if f.modified.get(node, 0) > clock:
+					break
+			else:
+				return True
+
+		del self.negatives[key]
+		return False
+
+	def handles(self, ident):
+		if isinstance(ident, expr.Var):
+			return True
+		if isinstance(ident, expr.Stack):
+			return self.heights is not None
+		return False
+
+	def location(self, ident, node):
+		if isinstance(ident, expr.Var):
+			return ident
+		assert (self.heights is not None)
+		return ("stack", ident.offset + self.heights[node])
+
+	def location_index(self, loc):
+		if loc not in self.locations:
+			self.locations[loc] = len(self.locations)
+		return self.locations[loc]
+
+	def get_uses(self, ins):
+		if id(ins) not in self.uses:
+			# an instruction which was added since the last refresh
+			return get_uses(ins)
+		return self.uses[id(ins)]
+
+	def defined_locations(self, node, ins, include_unused):
+		if utils.is_unused(ins) and not include_unused:
+			return []
+		return [self.location(r, node) for r in ins.results
+				if self.handles(r)]
+
+	def used_locations(self, node, uses):
+		return [self.location(e, node) for e in uses if self.handles(e)]
+
+	def compute_reaching_definitions(self):
+		# every definition gets a bit. On top of that every location gets an
+		# entry bit, for the paths on which it is never defined.
+		self.defs = [] # bit -> Def, or None for the entry
+		self.def_bits = {} # (id(ins), location) -> bit
+		self.defs_of = collections.defaultdict(int) # location -> bits
+
+		gen = {}
+		kill = {}
+
+		for node in self.nodes:
+			for ins, _ in self.summaries[node]:
+				# ":= unused" assignments are not real definitions
+				for loc in self.defined_locations(node, ins, False):
+					bit = 1 << len(self.defs)
+					self.defs.append(Def(node, ins, loc))
+					self.def_bits[(id(ins), loc)] = bit
+					self.defs_of[loc] |= bit
+
+		for node in self.nodes:
+			for _, uses in self.summaries[node]:
+				for loc in self.used_locations(node, uses):
+					self.location_index(loc)
+
+		entry = 0
+		self.entry_bits = {}
+		for loc in list(self.defs_of):
+			bit = 1 << len(self.defs)
+			self.defs.append(None)
+			self.entry_bits[loc] = bit
+			self.defs_of[loc] |= bit
+			entry |= bit
+
+		for node in self.nodes:
+			g, k = 0, 0
+			for ins, _ in self.summaries[node]:
+				for loc in self.defined_locations(node, ins, False):
+					k |= self.defs_of[loc]
+					g = (g & ~self.defs_of[loc]) | self.def_bits[(id(ins), loc)]
+			gen[node] = g
+			kill[node] = k
+
+		self.reaching_in, _ = solve_union(self.nodes, self.preds, gen, kill,
+			{self.function.header_node: entry})
+
+	def compute_liveness(self):
+		gen = {}
+		kill = {}
+		for node in self.nodes:
+			g, k = 0, 0
+			for ins, uses in reversed(self.summaries[node]):
+				# a ":= unused" assignment does end the lifetime of a value
+				for loc in self.defined_locations(node, ins, True):
+					bit = 1 << self.location_index(loc)
+					k |= bit
+					g &= ~bit
+				for loc in self.used_locations(node, uses):
+					g |= 1 << self.location_index(loc)
+			gen[node] = g
+			kill[node] = k
+
+		nodes = list(reversed(self.nodes))
+		self.live_out, _ = solve_union(nodes, self.succs, gen, kill, {})
+
+	def reaching_definitions(self, ident, point):
+		# returns the definitions of ident which reach the given point. None
+		# stands for the paths on which it is never defined.
+		loc = self.location(ident, point.node)
+
+		instrs = get_instrs(point.node)
+		index = instrs.index(point.ins)
+		for ins in reversed(instrs[:index]):
+			if loc in self.defined_locations(point.node, ins, False):
+				return [Def(point.node, ins, ident)]
+
+		if loc not in self.defs_of:
+			# never defined at all
+			return [None]
+
+		bits = self.reaching_in[point.node] & self.defs_of[loc]
+		result = []
+		while bits != 0:
+			low = bits & -bits
+			bits ^= low
+			d = self.defs[low.bit_length() - 1]
+			if d is None:
+				result.append(None)
+			else:
+				result.append(Def(d.point.node, d.point.ins, ident))
+		return result
+
+	def is_live_after(self, ident, point):
+		loc = self.location(ident, point.node)
+
+		instrs = get_instrs(point.node)
+		index = instrs.index(point.ins)
+		for ins in instrs[index+1:]:
+			if loc in self.used_locations(point.node, self.get_uses(ins)):
+				return True
+			if loc in self.defined_locations(point.node, ins, True):
+				return False
+
+		if loc not in self.locations:
+			return False
+		return bool(self.live_out[point.node] & (1 << self.locations[loc]))
+
+	def redefines(self, ins, offset, ident, ident_offset):
+		# whether ins may redefine ident. Offsets are what must be added to
+		# a stack offset in their node to get the same slot in a common
+		# frame. This mirrors what the explorer treats as a redefinition.
+		if (ins.type == hlir.ins_types.call
+				and isinstance(ident, (expr.Mem, expr.Storage))):
+			return True
+
+		unused = utils.is_unused(ins)
+		for res in ins.results:
+			if not isinstance(res, expr.Id):
+				continue
+			if isinstance(ident, expr.Stack) and isinstance(res, expr.Stack):
+				if ident.offset + ident_offset == res.offset + offset:
+					return True
+			elif unused:
+				if ids_must_be_equal(ident, res):
+					return True
+			elif ids_may_be_equal(ident, res):
+				return True
+		return False
+
+	def available_at(self, definition, use_point, visited=None):
+		# checks that no identifier in the RHS of the definition may be
+		# redefined on any path from the definition to the use point.
+		# Returns None if one may be, and otherwise what must be added to the
+		# offsets of stack variables in the RHS to use them at the use point.
+		# If visited is given, the nodes the answer depends on are added to
+		# it.
+		offsets = {use_point.node: 0}
+		try:
+			return self.find_available_offset(definition, use_point, offsets)
+		finally:
+			if visited is not None:
+				visited.update(offsets)
+
+	def find_available_offset(self, definition, use_point, offsets):
+		def_node, def_ins = definition.point.node, definition.point.ins
+
+		rhs_ids = []
+		for arg in def_ins.args:
+			for r in utils.visit_expr(arg):
+				if isinstance(r, expr.Id):
+					rhs_ids.append(r)
+		has_stack = any(isinstance(r, expr.Stack) for r in rhs_ids)
+
+		# first walk backwards from the use until the definition is found on
+		# every path, keeping track of the stack like the explorer does
+		instrs = get_instrs(use_point.node)
+		index = instrs.index(use_point.ins)
+		seen = set()
+		region = []
+		stack = [(use_point.node, instrs[:index])]
+		while len(stack) != 0:
+			node, instrs = stack.pop()
+			offset = offsets[node]
+
+			if def_ins in instrs:
+				# only what comes after the definition matters
+				region.append((node, instrs[instrs.index(def_ins)+1:], offset))
+				continue
+			region.append((node, instrs, offset))
+
+			if (node == self.function.header_node 
+					or len(self.preds[node]) == 0):
+				# got to the start of the function without passing the
+				# definition
+				return None
+
+			for pred in self.preds[node]:
+				pred_offset = offset - node.sp_delta
+				if offsets.setdefault(pred, pred_offset) != pred_offset:
+					if has_stack:
+						return None
+				if has_stack and utils.has_imprecise_successors(pred):
+					# the stack can't be tracked across indirect jumps
+					return None
+				if pred not in seen:
+					seen.add(pred)
+					stack.append((pred, get_instrs(pred)))
+
+		# then look for redefinitions in between
+		def_offset = offsets[def_node]
+		for node, instrs, offset in region:
+			for ins in instrs:
+				for r in rhs_ids:
+					if self.redefines(ins, offset, r, def_offset):
+						return None
+
+		return def_offset
+
+def get_dataflow(f):
+	# the dataflow tables of the function, brought up to date
+	if f.dataflow is None:
+		f.dataflow = FunctionDataflow(f)
+	else:
+		f.dataflow.refresh()
+	return f.dataflow
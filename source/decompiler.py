@@ -12,6 +12,12 @@ import cfa
 import astconverter
 import log
 import readability
+import instrumentation
+import settings
+
+# bump this whenever a change to the pipeline changes the decompiled code,
+# so that cached results from older versions are not reused
+PIPELINE_VERSION = 2
 
 class Decompiler:
 
@@ -21,6 +27,12 @@ class Decompiler:
 		self.constructor_ast = None
 
 		self.stats = {}
+		self.num_runs = 0
+		self.phases = None
+
+		self.profiler = None
+		if settings.profile_optimizations:
+			self.profiler = instrumentation.OptimizationProfiler()
 	
 	def set_optimization_hook(self, hook):
 		self.__unit_test_hook = hook
@@ -70,21 +82,26 @@ class Decompiler:
 			return bytecode[addr:addr+length]
 
 	def front_end(self, bytecode):
-		llir_instructions = parser.parse(bytecode)
+		llir_instructions = self.phases.measure("parse", parser.parse, bytecode)
 		self.stats["num_evm_instrs"] = len(llir_instructions)
 
-		llir_bbs = llir.split(llir_instructions)
+		llir_bbs = self.phases.measure("split", llir.split, llir_instructions)
 
-		contract = ll2hl.Converter().convert(llir_bbs, self.orig_bytecode)
+		contract = self.phases.measure("ll2hl",
+			ll2hl.Converter().convert, llir_bbs, self.orig_bytecode)
 
 		return contract
 	
 	def middle_end(self, contract, hook=None):
-		optimizer = middleend.Optimizer(contract, hook)
-		optimizer.optimize()
+		optimizer = middleend.Optimizer(contract, hook, self.profiler)
+		self.phases.measure_counting("optimize", contract, optimizer.optimize)
+		if self.profiler:
+			self.stats["optimization_profile"] = self.profiler.summary(True)
 
-		loops = cfa.discover_loops(contract)
-		cond_follows = cfa.discover_cond_follows(contract, loops)
+		loops = self.phases.measure_counting("discover_loops", contract,
+			cfa.discover_loops, contract)
+		cond_follows = self.phases.measure_counting("discover_cond_follows",
+			contract, cfa.discover_cond_follows, contract, loops)
 
 		return contract, loops, cond_follows
 
@@ -92,6 +109,10 @@ class Decompiler:
 		self.orig_bytecode = bytecode
 		bytecode = utils.remove_swarm_hash(bytecode)
 
+		self.phases = instrumentation.PhaseRecorder(
+			self.stats.setdefault("phases", []), self.num_runs)
+		self.num_runs += 1
+
 		contract = self.front_end(bytecode)
 
 		if self.__unit_test_hook:
@@ -100,18 +121,19 @@ class Decompiler:
 		contract, loops, cond_follows = self.middle_end(
 				contract, hook=self.__unit_test_hook)
 
-		ast = astconverter.convert(
+		ast = self.phases.measure("astconverter", astconverter.convert,
 				contract, loops, cond_follows, self.constructor_ast)
 
 		if self.__unit_test_hook:
 			self.__unit_test_hook(ast)
 
-		ast = readability.improve(ast)
+		ast = self.phases.measure("readability", readability.improve, ast)
 
 		if self.__unit_test_hook:
 			self.__unit_test_hook(ast)
 
-		code = codegen.generate_code(self.stats, ast)
+		code = self.phases.measure_counting("codegen", ast,
+			codegen.generate_code, self.stats, ast)
 
 		return contract, ast, code
 	
@@ -133,3 +155,40 @@ class Decompiler:
 
 		return contract, ast, code
 	
+
+	def json_stats(self, ast):
+		# a copy of self.stats that can be serialized, with the functions
+		# identified by their addresses
+		result = {}
+		for k, v in self.stats.items():
+			if k == "funcs_with_gotos":
+				v = dict(("0x%x" % f.address, n) for f, n in v.items())
+			result[k] = v
+
+		result["func_complexities"] = dict(
+			("0x%x" % f.address, f.num_statements()) for f in ast.functions)
+
+		return result
+
+	def decompile_cached(self, bytecode, result_cache):
+		# like decompile, but looks up the result in a cache.ResultCache
+		# first. Only the code is returned, since neither the contract nor
+		# the ast are cached; self.stats is set to the json_stats of the
+		# result. Returns the code and whether it came from the cache.
+		key = result_cache.make_key(bytecode)
+
+		result = result_cache.get(key)
+		if result is not None:
+			# the phase timings are those of the run which filled the
+			# cache, and none of those phases ran now
+			self.stats = result["stats"]
+			self.stats.pop("phases", None)
+			self.stats["cached"] = True
+			return result["code"], True
+
+		contract, ast, code = self.decompile(bytecode)
+		self.stats = self.json_stats(ast)
+
+		result_cache.put(key, {"code": code, "stats": self.stats})
+
+		return code, False
@@ -0,0 +1,152 @@
+# dominator and post-dominator trees.
+#
+# the trees are computed with the iterative algorithm by Cooper, Harvey and
+# Kennedy, which is simple and, on the small graphs we deal with, as fast as
+# Lengauer-Tarjan. The graph is given by a root and functions returning the
+# successors and predecessors of a node, so the same code handles the plain
+# CFG, the reversed CFG for post-dominators, and filtered CFGs like the one
+# conditional structuring works on.
+#
+# the dominator tree of a function's CFG is cached by draw.NodeContainer, see
+# NodeContainer.dominators. Post-dominator trees are built on the filtered
+# CFG conditional structuring works on, so they aren't cached.
+
+class VirtualExit:
+	# the root of a post-dominator tree, which every exit of the graph goes to
+	def __str__(self):
+		return "exit"
+
+def reverse_postorder(root, succ_func):
+	result = []
+	seen = set([root])
+	stack = [(root, iter(succ_func(root)))]
+	while len(stack) != 0:
+		node, succs = stack[-1]
+		for s in succs:
+			if s not in seen:
+				seen.add(s)
+				stack.append((s, iter(succ_func(s))))
+				break
+		else:
+			stack.pop()
+			result.append(node)
+	result.reverse()
+	return result
+
+class DominatorTree:
+	def __init__(self, root, succ_func, pred_func):
+		self.root = root
+
+		# only the nodes reachable from the root are in the tree
+		self.order = reverse_postorder(root, succ_func)
+		self.index = {n: i for i, n in enumerate(self.order)}
+		self.pred_lists = {n: [p for p in pred_func(n) if p in self.index]
+						   for n in self.order}
+
+		self.idom = self.compute_idoms()
+		self.children = {n: [] for n in self.order}
+		for n in self.order[1:]:
+			self.children[self.idom[n]].append(n)
+
+		self.frontiers = None
+
+	def preds(self, n):
+		# the predecessors of n which are in the tree
+		return self.pred_lists[n]
+
+	def compute_idoms(self):
+		# returns the map from every node to its immediate dominator; the
+		# root maps to None.
+		index = self.index
+		idom = {self.root: self.root}
+		changed = True
+		while changed:
+			changed = False
+			for n in self.order[1:]:
+				new_idom = None
+				for p in self.preds(n):
+					if p not in idom:
+						continue
+					if new_idom is None:
+						new_idom = p
+						continue
+					# intersect
+					a, b = p, new_idom
+					while a is not b:
+						while index[a] > index[b]:
+							a = idom[a]
+						while index[b] > index[a]:
+							b = idom[b]
+					new_idom = a
+				if idom.get(n) is not new_idom:
+					idom[n] = new_idom
+					changed = True
+
+		idom[self.root] = None
+		return idom
+
+	def immediate(self, n):
+		# the immediate dominator of n, or None for the root, for nodes
+		# outside the tree, and for nodes only dominated by a virtual exit
+		result = self.idom.get(n)
+		if isinstance(result, VirtualExit):
+			return None
+		return result
+
+	def get_frontiers(self):
+		# node -> its dominance frontier, computed on first use
+		if self.frontiers is None:
+			frontiers = {n: set() for n in self.order}
+			for n in self.order:
+				preds = self.preds(n)
+				if len(preds) < 2:
+					continue
+				for p in preds:
+					runner = p
+					while runner is not None and runner is not self.idom[n]:
+						frontiers[runner].add(n)
+						runner = self.idom[runner]
+			self.frontiers = frontiers
+		return self.frontiers
+
+def reachable_nodes(roots, succ_func):
+	result = []
+	seen = set(roots)
+	stack = list(roots)
+	while len(stack) != 0:
+		node = stack.pop()
+		result.append(node)
+		for s in succ_func(node):
+			if s not in seen:
+				seen.add(s)
+				stack.append(s)
+	return result
+
+def post_dominator_tree(roots, succ_func):
+	# the post-dominator tree of the nodes reachable from the given roots.
+	# Its root is a VirtualExit which all nodes without successors go to.
+	# Nodes which can't reach an exit, e.g. in endless loops, aren't in the
+	# tree.
+	nodes = reachable_nodes(roots, succ_func)
+	virtual_exit = VirtualExit()
+	exits = [n for n in nodes if len(succ_func(n)) == 0]
+
+	preds = {n: [] for n in nodes}
+	for n in nodes:
+		for s in succ_func(n):
+			preds[s].append(n)
+
+	def reversed_succs(n):
+		if n is virtual_exit:
+			return exits
+		return preds[n]
+
+	def reversed_preds(n):
+		if n is virtual_exit:
+			return []
+		succs = succ_func(n)
+		if len(succs) == 0:
+			return [virtual_exit]
+		return succs
+
+	return DominatorTree(virtual_exit, reversed_succs, reversed_preds)
@@ -1,8 +1,15 @@
 
+import dominance
+
 class NodeContainer:
 	def __init__(self, h):
 		self.__cached_nodes = None
 		self.header_node = h
+
+		# what is derived from the node set, like the address index and the
+		# dominator trees, and the node set and header it was derived from
+		self.__derived = {}
+		self.__derived_from = None
 	
 	def invalidate_cached_nodes(self):
 		self.__cached_nodes = None
@@ -12,6 +19,31 @@ class NodeContainer:
 			self.__cached_nodes = self.header_node.reachable_nodes()
 		return self.__cached_nodes
 
+	def derived(self, name, compute):
+		# returns compute(), cached until the node set is recomputed. Every
+		# edge change invalidates the node set, so this is never stale as
+		# long as only edges change. The result must not be modified by the
+		# caller.
+		key = (self.nodes(), self.header_node)
+		if (self.__derived_from is None or key[0] is not self.__derived_from[0]
+				or key[1] is not self.__derived_from[1]):
+			self.__derived = {}
+			self.__derived_from = key
+		if name not in self.__derived:
+			self.__derived[name] = compute()
+		return self.__derived[name]
+
+	def get_nodes_by_addr(self):
+		# address -> node
+		return self.derived("nodes_by_addr",
+			lambda: {node.address: node for node in self.nodes()})
+
+	def dominators(self):
+		return self.derived("dominators", lambda: dominance.DominatorTree(
+			self.header_node,
+			lambda n: n.get_successors(),
+			lambda n: n.get_predecessors()))
+
 	def to_dot_file(self):
 		out  = "subgraph G {\n"
 		for node in sorted(self.nodes(), key=_key):
@@ -36,7 +68,7 @@ def _key(n):
 	except AttributeError:
 		return id(n)
 
-class Node:
+class Node(object):
 	def to_dot_file(self):
 		out = ""
 		label = str(self).replace("\n", "\\l")
@@ -2,13 +2,15 @@ from middleend import Optimization
 import hlir
 import expr
 import dataflow
+import ssa
 import utils
 import vmcall
 
 class UnusedVariableElimination(Optimization):
 	is_cheap = True
+	is_node_local = True
 	def optimize(self, f):
-		for node in f.nodes():
+		for node in self.nodes_to_visit(f):
 			for ins in list(node.get_instructions()):
 				if utils.is_unused(ins):
 					node.remove_instruction(ins)
@@ -27,9 +29,8 @@ class LocalVariableElimination(Optimization):
 		def collect(e):
 			if isinstance(e, expr.Var):
 				result.add(e)
-			return e
 		for node in f.nodes():
-			utils.visit_and_modify_expressions(node, collect, True)
+			utils.visit_expressions(node, collect, True)
 
 		return result
 
@@ -55,6 +56,16 @@ class DCE(Optimization):
 		self.reached_redefinition = False
 		self.terminated = False
 
+		# variables and stack slots are looked up in the liveness tables,
+		# which cover the whole function. The rest is left to the explorer.
+		# ":= unused" assignments are not definitions in SSA form
+		if (self.ssa is not None and isinstance(var, expr.Var) 
+				and not utils.is_unused(def_point.ins)):
+			return not self.ssa.is_live(var, def_point)
+
+		if self.dataflow.handles(var):
+			return not self.dataflow.is_live_after(var, def_point)
+
 		def lhs_redefined(_):
 			self.reached_redefinition = True
 			return dataflow.DefUseExplorer.STOP_EXPLORING_PATH
@@ -83,6 +94,8 @@ class DCE(Optimization):
 			explorer.explore()
 		except dataflow.ExplorationFailedException:
 			return False
+		finally:
+			self.region = explorer.visited
 
 		if not inter_bb:
 			if not self.reached_redefinition and not self.terminated:
@@ -107,22 +120,36 @@ class DCE(Optimization):
 		# TODO: once again handle the case where this is an intra-BB analysis,
 		# but there are no successors.
 
-		def_point = dataflow.ProgramPoint(bb, ins)
-
-		if not self.safe_to_eliminate(var, def_point):
-			return
-
 		# we go with the safe option and never eliminate stores to storage
 		if (isinstance(var, expr.Storage) 
 				or isinstance(var, expr.NamedStorageAccess)):
 			return
 
+		if self.dataflow is None:
+			self.dataflow = dataflow.get_dataflow(self.function)
+
+		# definitions which took an exploration to keep are remembered
+		# until a node on the way changes
+		key = (self.__class__.__name__, id(ins))
+		if self.dataflow.known_negative(key):
+			return
+
+		def_point = dataflow.ProgramPoint(bb, ins)
+
+		self.region = None
+		if (self.safe_to_eliminate(var, def_point) 
+				and self.eliminable(var)):
+			bb.remove_instruction(ins)
+			self.changed = True
+		elif self.region is not None:
+			self.dataflow.add_negative(key, self.region, ins)
+
+	def eliminable(self, var):
+		# whether a dead definition of var may be removed
 		if isinstance(var, expr.Mem):
 			if self.is_inter_bb() or not self.terminated:
-				return
-
-		bb.remove_instruction(ins)
-		self.changed = True
+				return False
+		return True
 
 	def eliminate_dead_code(self):
 		for bb in self.function.bbs():
@@ -131,6 +158,10 @@ class DCE(Optimization):
 		
 	def optimize(self, f):
 		self.uses_cache = {}
+		self.dataflow = None
+		self.ssa = None
+		if f.flattened and self.is_inter_bb():
+			self.ssa = ssa.SSAForm(f)
 		self.function = f
 		self.eliminate_dead_code()
 
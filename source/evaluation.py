@@ -2,6 +2,7 @@ import os
 import sys
 import utils
 import decompiler
+import batch
 import traceback
 import time
 import json
@@ -65,28 +66,10 @@ begin = time.time()
 try:
 	contract, ast, code = d.decompile(bytecode)
 	end = time.time()
-	success = {}
-	success["num_funcs"] = len(ast.functions)
-	success["num_gotos"] = d.stats["num_gotos"]
-	success["num_funcs_with_gotos"] = len(d.stats["funcs_with_gotos"])
-
-	goto_func_complexities = []
-	other_func_complexities = []
-	for f in ast.functions:
-		if f in d.stats["funcs_with_gotos"]:
-			goto_func_complexities.append(f.num_statements())
-		else:
-			other_func_complexities.append(f.num_statements())
-
-	success["goto_func_complexities"] = goto_func_complexities
-	success["other_func_complexities"] = other_func_complexities
-
-	success["num_evm_instrs"] = d.stats["num_evm_instrs"]
+	success = batch.make_success_record(d.json_stats(ast), code)
 
 	print("Success:")
-	print(success)
-		
-	success["output"] = code
+	print(dict((k, v) for k, v in success.items() if k != "output"))
 
 	data["success"] = success
 
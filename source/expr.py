@@ -1,5 +1,6 @@
 import utils
 import tree
+import weakref
 import vmcall
 from interpreter import Value, UndefinedValue
 from numbers import Number
@@ -8,6 +9,7 @@ import settings
 # TODO: all arithmetic in evaluate() should be done modulo 2**256.
 
 class Expression(tree.Node):
+	__slots__ = ()
 	def __str__(self):
 		print(self.__class__)
 		raise NotImplementedError()
@@ -19,6 +21,7 @@ class Expression(tree.Node):
 		raise NotImplementedError()
 
 class UnusedValue(Expression):
+	__slots__ = ()
 	child_names = []
 	def __str__(self):
 		return "unused"
@@ -32,9 +35,11 @@ class UnusedValue(Expression):
 ### identifiers ###
 
 class Id(Expression):
+	__slots__ = ()
 	pass
 
 class Stack(Id):
+	__slots__ = ("offset", "bb")
 	child_names = []
 	def __init__(self, offset):
 		self.offset = offset
@@ -65,12 +70,14 @@ class Stack(Id):
 		# about whether they're in the same BB, and if so, compare offsets.
 		assert (False)
 	def __hash__(self):
-		return 0x1111
+		# stack variables are never equal, so they are hashed by identity
+		return id(self)
 	
 	def evaluate(self, interp):
 		return interp.access_stack(self.offset)
 
 class Mem(Id):
+	__slots__ = ("address", "length")
 	child_names = ["address", "length"]
 	def __init__(self, addr, length):
 		assert (isinstance(addr, Expression))
@@ -108,13 +115,19 @@ class Mem(Id):
 
 		return self.address == other.address and self.length == other.length
 	def __hash__(self):
-		return 0x2222
+		# only literal regions can be compared; the others are hashed by
+		# identity. Like for Lit, the hash follows the current value, so an
+		# access must not be modified while it's in a set or a dict.
+		if isinstance(self.address, Lit) and isinstance(self.length, Lit):
+			return hash((self.address.literal, self.length.literal))
+		return id(self)
 	def evaluate(self, interp):
 		addr = self.address.evaluate(interp).num()
 		length = self.length.evaluate(interp).num()
 		return interp.access_mem(addr, length)
 
 class PureFunctionCall(Expression):
+	__slots__ = ("name", "args")
 	child_names = ["args"]
 	def __init__(self, name, args):
 		self.name = name
@@ -135,6 +148,7 @@ class PureFunctionCall(Expression):
 		return results[0]
 
 class Sequence(Expression):
+	__slots__ = ("expressions",)
 	child_names = ["expressions"]
 	def __init__(self, exprs):
 		self.expressions = exprs
@@ -171,6 +185,7 @@ class Sequence(Expression):
 		return Sequence([e.copy() for e in self.expressions])
 
 class Storage(Id):
+	__slots__ = ("address",)
 	def __init__(self, addr):
 		assert (isinstance(addr, Expression))
 		self.address = addr
@@ -190,7 +205,10 @@ class Storage(Id):
 		return self.address == other.address
 
 	def __hash__(self):
-		return 0x3333
+		# see Mem.__hash__
+		if isinstance(self.address, Lit):
+			return hash(self.address.literal)
+		return id(self)
 
 	def gen_code(self, o):
 		# TODO: this should use a table lookup.
@@ -202,6 +220,7 @@ class Storage(Id):
 	child_names = ["address"]
 
 class NamedStorageAccess(Id):
+	__slots__ = ("num", "offset")
 	child_names = ["offset"]
 	def __init__(self, num, offset):
 		assert (isinstance(num, int))
@@ -233,6 +252,7 @@ class NamedStorageAccess(Id):
 		raise NotImplementedError()
 
 class MappingAccess(NamedStorageAccess):
+	__slots__ = ()
 	access_type = "mapping"
 	def compute_address(self, interp):
 		seq = Sequence([self.offset, Lit(self.num)])
@@ -242,6 +262,7 @@ class MappingAccess(NamedStorageAccess):
 		return results[0].num()
 	
 class ArrayAccess(NamedStorageAccess):
+	__slots__ = ()
 	access_type = "array"
 	def compute_address(self, interp):
 		seq = Sequence([Lit(self.num)])
@@ -252,8 +273,13 @@ class ArrayAccess(NamedStorageAccess):
 
 # a local variable
 class Var(Id):
+	__slots__ = ("name", "pinned")
 	def __init__(self):
 		self.name = None # assigned later
+
+		# set for the variables propagation.ValueNumbering binds values to,
+		# which must not be propagated back into their uses
+		self.pinned = False
 	def copy(self):
 		return self
 	def __str__(self):
@@ -272,9 +298,19 @@ class Var(Id):
 	child_names = []
 
 class GlobalVar(Id):
-	def __init__(self, name):
+	__slots__ = ("name", "__weakref__")
+
+	# global variables are immutable and interned, like literals
+	table = weakref.WeakValueDictionary()
+
+	def __new__(cls, name):
 		assert (isinstance(name, str))
-		self.name = name
+		result = cls.table.get(name)
+		if result is None:
+			result = Id.__new__(cls)
+			result.name = name
+			cls.table[name] = result
+		return result
 	
 	def __str__(self):
 		return self.name
@@ -286,7 +322,7 @@ class GlobalVar(Id):
 		return interp.lookup_global(self.name)
 	
 	def copy(self):
-		return GlobalVar(self.name)
+		return self
 
 	child_names = []
 
@@ -295,9 +331,21 @@ class GlobalVar(Id):
 ### literal ###
 
 class Lit(Expression):
-	def __init__(self, n):
+	__slots__ = ("literal", "__weakref__")
+
+	# literals are immutable and there is only ever one Lit per value, so
+	# copying one is free and comparing two is an identity check. The table
+	# doesn't keep literals alive which are no longer used.
+	table = weakref.WeakValueDictionary()
+
+	def __new__(cls, n):
 		assert (isinstance(n, Number))
-		self.literal = n
+		result = cls.table.get(n)
+		if result is None:
+			result = Expression.__new__(cls)
+			result.literal = n
+			cls.table[n] = result
+		return result
 	def __str__(self):
 		return "0x%x" % self.literal
 	def gen_code(self, o):
@@ -306,17 +354,16 @@ class Lit(Expression):
 		return Value(self.literal)
 	child_names = []
 	def __eq__(self, other):
-		if not isinstance(other, Lit):
-			return False
-		return self.literal == other.literal
+		return self is other
 	def __hash__(self):
-		return self.literal
+		return hash(self.literal)
 	def copy(self):
-		return Lit(self.literal)
+		return self
 
 ### binary ops ###
 
 class BinaryOp(Expression):
+	__slots__ = ("operand1", "operand2")
 	symbol = "?" # set in subclasses
 	def __init__(self, op1, op2):
 		self.operand1 = op1
@@ -342,6 +389,7 @@ class BinaryOp(Expression):
 # this is not a good example of a binary op, but it's convenient to treat it
 # as such.
 class SignExtend(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = "extend"
 	def evaluate(self, interp):
@@ -351,6 +399,7 @@ class SignExtend(BinaryOp):
 		return Value(utils.extend(value, nbits))
 	
 class SGt(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = ">"
 	def evaluate(self, interp):
@@ -358,6 +407,7 @@ class SGt(BinaryOp):
 					 utils.signed(self.operand2.evaluate(interp).num()))
 
 class Gt(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = ">"
 	def evaluate(self, interp):
@@ -365,6 +415,7 @@ class Gt(BinaryOp):
 					 self.operand2.evaluate(interp).num())
 
 class Lt(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = "<"
 	def evaluate(self, interp):
@@ -372,6 +423,7 @@ class Lt(BinaryOp):
 					 self.operand2.evaluate(interp).num())
 
 class SLt(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = "<"
 	def evaluate(self, interp):
@@ -379,6 +431,7 @@ class SLt(BinaryOp):
 					 utils.signed(self.operand2.evaluate(interp).num()))
 
 class Div(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = "/"
 	def evaluate(self, interp):
@@ -391,6 +444,7 @@ class Div(BinaryOp):
 
 
 class SDiv(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = "/"
 	def evaluate(self, interp):
@@ -400,6 +454,7 @@ class SDiv(BinaryOp):
 					 utils.signed(self.operand2.evaluate(interp).num()))
 
 class And(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = "&"
 	def evaluate(self, interp):
@@ -434,6 +489,7 @@ class And(BinaryOp):
 		return BinaryOp.gen_code(self, o)
 
 class Or(BinaryOp):
+	__slots__ = ()
 	is_commutative = True
 	symbol = "|"
 	def evaluate(self, interp):
@@ -441,6 +497,7 @@ class Or(BinaryOp):
 					 self.operand2.evaluate(interp).num())
 
 class Sub(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = "-"
 	def evaluate(self, interp):
@@ -448,6 +505,7 @@ class Sub(BinaryOp):
 					 self.operand2.evaluate(interp).num())
 
 class Mul(BinaryOp):
+	__slots__ = ()
 	is_commutative = True
 	symbol = "*"
 	def evaluate(self, interp):
@@ -455,6 +513,7 @@ class Mul(BinaryOp):
 					 self.operand2.evaluate(interp).num())
 
 class Add(BinaryOp):
+	__slots__ = ()
 	is_commutative = True
 	symbol = "+"
 	def evaluate(self, interp):
@@ -462,6 +521,7 @@ class Add(BinaryOp):
 					 self.operand2.evaluate(interp).num())
 	
 class Xor(BinaryOp):
+	__slots__ = ()
 	is_commutative = True
 	symbol = "^"
 	def evaluate(self, interp):
@@ -469,6 +529,7 @@ class Xor(BinaryOp):
 					 self.operand2.evaluate(interp).num())
 
 class Eq(BinaryOp):
+	__slots__ = ()
 	is_commutative = True
 	symbol = "=="
 	def evaluate(self, interp):
@@ -477,6 +538,7 @@ class Eq(BinaryOp):
 		return Value(a == b)
 
 class Exp(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = "**"
 	def evaluate(self, interp):
@@ -484,6 +546,7 @@ class Exp(BinaryOp):
 					 self.operand2.evaluate(interp).num())
 
 class Mod(BinaryOp):
+	__slots__ = ()
 	is_commutative = False
 	symbol = "%"
 	def evaluate(self, interp):
@@ -493,6 +556,7 @@ class Mod(BinaryOp):
 ### unary ops ###
 
 class UnaryOp(Expression):
+	__slots__ = ("operand",)
 	symbol = "?" # set properly in subclasses
 	def __init__(self, op):
 		self.operand = op
@@ -513,6 +577,7 @@ class UnaryOp(Expression):
 
 # logical negation
 class Not(UnaryOp):
+	__slots__ = ()
 	symbol = "!"
 	def evaluate(self, interp):
 		result = self.operand.evaluate(interp).num()
@@ -532,6 +597,7 @@ class Not(UnaryOp):
 
 # bitwise negation
 class Neg(UnaryOp):
+	__slots__ = ()
 	symbol = "~"
 	def evaluate(self, interp):
 		return Value(utils.neg(self.operand.evaluate(interp).num(), 256))
@@ -0,0 +1,357 @@
+import hashlib
+import collections
+
+import expr
+import hlir
+import function
+import addressdispenser
+
+# per-process memoization of optimized functions.
+#
+# many contracts share identical functions (SafeMath, ERC20 transfer,
+# modifiers, ...). Before a function goes through the fixpoint loop, a
+# canonical encoding of its HLIR subgraph is computed. If an identical
+# function has been optimized before, its optimized body is rebuilt from the
+# memo instead of running the optimizations again.
+#
+# the canonical encoding must not depend on anything that differs between
+# otherwise identical functions:
+# - nodes are ordered by a DFS from the header which visits successors in
+#   address order
+# - BB addresses are stored relative to the function header, except for
+#   the addresses handed out by the addressdispenser, which are numbered in
+#   order of appearance. Those handed out during optimization are replaced by
+#   fresh ones on restore
+# - variables are numbered in order of appearance, and keep whether they
+#   are pinned (see propagation.ValueNumbering)
+# - callees are numbered in order of appearance
+# - a next_bb outside of the function is stored as the input node it is, or
+#   the input node it followed
+#
+# a function is not memoized if a literal outside of a jump target equals one
+# of its BB addresses, since we could not tell whether it should be
+# relocated.
+
+MAX_ENTRIES = 4096
+
+class Uncacheable(Exception):
+	pass
+
+class Encoder:
+	def __init__(self, f):
+		self.function = f
+		self.base = f.header_node.address
+		if self.base is None or self.base >= addressdispenser.FIRST_ADDRESS:
+			raise Uncacheable()
+
+		self.vars = {} # id(var) -> index
+		self.var_list = []
+		self.callees = {} # id(function) -> index
+		self.callee_list = []
+
+		self.input_addrs = set()
+		self.input_nodes = [] # the nodes of the input, in encoding order
+		self.input_index = {} # input node -> its index
+		self.input_next_bbs = {} # next_bb of an input node -> its index
+		self.gen_addrs = {} # dispensed address of an input node -> index
+		self.gen_list = []
+		self.new_addrs = {} # address -> index
+		self.addrs = set() # addresses of the nodes being encoded
+
+	def ordered_nodes(self, f):
+		result = []
+		seen = set()
+		stack = [f.header_node]
+		while len(stack) != 0:
+			n = stack.pop()
+			if n in seen:
+				continue
+			seen.add(n)
+			result.append(n)
+
+			succs = n.get_successors()
+			for s in succs:
+				if not isinstance(s, hlir.BasicBlock) or s.address is None:
+					raise Uncacheable()
+			# push in reverse so that the lowest address is visited first
+			for s in sorted(succs, key=lambda s: s.address, reverse=True):
+				stack.append(s)
+		return result
+
+	def encode_addr(self, addr, is_input):
+		if addr in self.gen_addrs:
+			return ("gen", self.gen_addrs[addr])
+		if addr in self.input_addrs:
+			if addr >= addressdispenser.FIRST_ADDRESS:
+				self.gen_addrs[addr] = len(self.gen_list)
+				self.gen_list.append(addr)
+				return ("gen", self.gen_addrs[addr])
+			return ("rel", addr - self.base)
+		if is_input:
+			raise Uncacheable()
+		if addr not in self.new_addrs:
+			self.new_addrs[addr] = len(self.new_addrs)
+		return ("new", self.new_addrs[addr])
+
+	def encode_var(self, v):
+		if id(v) not in self.vars:
+			self.vars[id(v)] = len(self.var_list)
+			self.var_list.append(v)
+		return ("var", self.vars[id(v)], v.pinned)
+
+	def encode_expr(self, e):
+		cls = e.__class__
+
+		if cls is expr.Var:
+			return self.encode_var(e)
+
+		if cls is expr.Lit:
+			if e.literal in self.addrs:
+				raise Uncacheable()
+			return ("lit", e.literal)
+
+		if cls is expr.Stack:
+			return ("stack", e.offset)
+
+		if cls is expr.GlobalVar:
+			return ("global", e.name)
+
+		if isinstance(e, expr.NamedStorageAccess):
+			attrs = (e.num,)
+		elif cls is expr.PureFunctionCall:
+			attrs = (e.name,)
+		else:
+			attrs = ()
+
+		children = []
+		for child_name in e.child_names:
+			child = getattr(e, child_name)
+			if isinstance(child, list):
+				children.append([self.encode_expr(c) for c in child])
+			else:
+				children.append(self.encode_expr(child))
+
+		return (cls.__name__, attrs, tuple(
+			tuple(c) if isinstance(c, list) else c for c in children))
+
+	def encode_loc(self, ins, is_input):
+		loc = ins.loc
+		if loc is None:
+			return None
+
+		if isinstance(loc, str):
+			return ("str", loc)
+
+		if isinstance(loc, function.Function):
+			if id(loc) not in self.callees:
+				if not is_input:
+					# optimizations never introduce calls to new functions
+					raise Uncacheable()
+				self.callees[id(loc)] = len(self.callee_list)
+				self.callee_list.append(loc)
+			return ("func", self.callees[id(loc)])
+
+		if (ins.type in (hlir.ins_types.jump, hlir.ins_types.jcond)
+				and isinstance(loc, expr.Lit) and loc.literal in self.addrs):
+			return ("addr", self.encode_addr(loc.literal, is_input))
+
+		return self.encode_expr(loc)
+
+	def encode_ins(self, ins, is_input):
+		results = tuple(self.encode_expr(r) for r in ins.results)
+		args = tuple(self.encode_expr(a) for a in ins.args)
+		return (ins.type, results, args, self.encode_loc(ins, is_input))
+
+	def encode_outside_next_bb(self, bb):
+		# a next_bb which isn't part of the function, e.g. since it was
+		# removed by an optimization, is identified by the input node it is,
+		# or the input node it followed
+		if bb in self.input_index:
+			return ("input", self.input_index[bb])
+		if bb in self.input_next_bbs:
+			return ("input_next", self.input_next_bbs[bb])
+		return None
+
+	def encode(self, is_input):
+		f = self.function
+		if f.header_node.address != self.base:
+			raise Uncacheable()
+
+		nodes = self.ordered_nodes(f)
+		addrs = set(n.address for n in nodes)
+		if len(addrs) != len(nodes):
+			raise Uncacheable()
+		if is_input:
+			self.input_addrs = addrs
+			self.input_nodes = nodes
+			for i, n in enumerate(nodes):
+				self.input_index[n] = i
+				if n.next_bb is not None:
+					self.input_next_bbs.setdefault(n.next_bb, i)
+		self.addrs = addrs | self.input_addrs
+
+		index = {n: i for i, n in enumerate(nodes)}
+
+		params = tuple(self.encode_expr(p) for p in f.params)
+
+		result = []
+		for n in nodes:
+			addr = self.encode_addr(n.address, is_input)
+			instrs = tuple(self.encode_ins(ins, is_input)
+						   for ins in n.get_instructions())
+			terminator = self.encode_ins(n.terminator, is_input)
+			succs = tuple(sorted(index[s] for s in n.get_successors()))
+
+			if n.next_bb is None:
+				next_bb = None
+			elif n.next_bb in index:
+				next_bb = index[n.next_bb]
+			else:
+				next_bb = self.encode_outside_next_bb(n.next_bb)
+
+			result.append((addr, n.sp_delta, instrs, terminator, succs, next_bb))
+
+		return (f.external, f.flattened, f.num_params, f.num_retvals, params,
+				tuple(result))
+
+class Decoder:
+	def __init__(self, encoder):
+		self.encoder = encoder
+		self.vars = list(encoder.var_list)
+		self.new_addrs = {}
+
+
+	def decode_addr(self, enc):
+		kind, value = enc
+		if kind == "rel":
+			return self.encoder.base + value
+		if kind == "gen":
+			return self.encoder.gen_list[value]
+		if value not in self.new_addrs:
+			self.new_addrs[value] = addressdispenser.get_new_address()
+		return self.new_addrs[value]
+
+	def decode_expr(self, enc):
+		kind = enc[0]
+		if kind == "var":
+			while enc[1] >= len(self.vars):
+				self.vars.append(expr.Var())
+			v = self.vars[enc[1]]
+			v.pinned = enc[2]
+			return v
+		if kind == "lit":
+			return expr.Lit(enc[1])
+		if kind == "stack":
+			return expr.Stack(enc[1])
+		if kind == "global":
+			return expr.GlobalVar(enc[1])
+
+		_, attrs, children = enc
+		args = list(attrs)
+		for c in children:
+			if isinstance(c, tuple) and (len(c) == 0 or isinstance(c[0], tuple)):
+				args.append([self.decode_expr(x) for x in c])
+			else:
+				args.append(self.decode_expr(c))
+		return getattr(expr, kind)(*args)
+
+	def decode_loc(self, enc):
+		if enc is None:
+			return None
+		kind = enc[0]
+		if kind == "str":
+			return enc[1]
+		if kind == "func":
+			return self.encoder.callee_list[enc[1]]
+		if kind == "addr":
+			return expr.Lit(self.decode_addr(enc[1]))
+		return self.decode_expr(enc)
+
+	def decode_ins(self, enc):
+		typ, results, args, loc = enc
+		return hlir.Instruction(typ,
+			[self.decode_expr(r) for r in results],
+			[self.decode_expr(a) for a in args],
+			self.decode_loc(loc))
+
+	def restore(self, recipe):
+		f = self.encoder.function
+		external, flattened, num_params, num_retvals, params, nodes = recipe
+
+		new_nodes = []
+		for addr, sp_delta, instrs, terminator, _, _ in nodes:
+			bb = hlir.BasicBlock(self.decode_addr(addr),
+				[self.decode_ins(ins) for ins in instrs], sp_delta)
+			bb.terminator = self.decode_ins(terminator)
+			bb.function = f
+			new_nodes.append(bb)
+
+		for bb, (_, _, _, _, succs, next_bb) in zip(new_nodes, nodes):
+			for s in succs:
+				bb.add_successor(new_nodes[s])
+
+			if next_bb is None:
+				bb.next_bb = None
+			elif isinstance(next_bb, tuple):
+				# the same input node of the function being restored
+				kind, i = next_bb
+				input_node = self.encoder.input_nodes[i]
+				if kind == "input":
+					bb.next_bb = input_node
+				else:
+					bb.next_bb = input_node.next_bb
+			else:
+				bb.next_bb = new_nodes[next_bb]
+
+		f.header_node = new_nodes[0]
+		f.params = [self.decode_expr(p) for p in params]
+		f.num_params = num_params
+		f.num_retvals = num_retvals
+		f.flattened = flattened
+		f.invalidate_cached_nodes()
+		f.mark_all_modified()
+
+class FunctionMemo:
+	def __init__(self, max_entries=MAX_ENTRIES):
+		self.max_entries = max_entries
+		self.entries = collections.OrderedDict()
+
+		self.hits = 0
+		self.misses = 0
+
+	def fingerprint(self, f):
+		# returns None if the function can't be memoized
+		try:
+			encoder = Encoder(f)
+			encoding = encoder.encode(True)
+		except Uncacheable:
+			return None
+		key = hashlib.sha1(repr(encoding)).digest()
+		return key, encoder
+
+	def restore(self, fingerprint, f):
+		key, encoder = fingerprint
+		recipe = self.entries.pop(key, None)
+		if recipe is None:
+			self.misses += 1
+			return False
+
+		# keep the most recently used entries at the end
+		self.entries[key] = recipe
+		self.hits += 1
+
+		Decoder(encoder).restore(recipe)
+		return True
+
+	def store(self, fingerprint, f):
+		key, encoder = fingerprint
+		try:
+			recipe = encoder.encode(False)
+		except Uncacheable:
+			return
+
+		self.entries[key] = recipe
+		while len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+
+memo = FunctionMemo()
@@ -14,26 +14,35 @@ class Function(draw.NodeContainer):
 		self.external = external
 
 		self.flattened = False
-	
-	def get_nodes_by_addr(self):
-		return {node.address: node for node in self.nodes()}
-	
-	def checksum(self):
-		c = 0
-		c += hash(self.header_node)
-		c += hash(self.address)
-		c += hash(self.num_params)
-		c += hash(self.num_retvals)
-		for p in self.params:
-			c += hash(p)
-		for node in self.nodes():
-			c += hash(node)
-			for s in node.get_successors():
-				c += hash(s)
-			for p in node.get_predecessors():
-				c += hash(p)
-		return c
 
+		# a journal of mutations: the clock ticks whenever one of the
+		# function's nodes changes, and 'modified' maps every changed node to
+		# the tick of its last change. This lets the optimizer tell what
+		# changed since a pass last ran, and check in O(1) that a pass which
+		# reports no change really didn't change anything.
+		self.clock = 0
+		self.modified = {}
+		self.all_modified = 0
+
+		# the dataflow tables, see dataflow.get_dataflow
+		self.dataflow = None
+
+	def mark_modified(self, node):
+		self.clock += 1
+		self.modified[node] = self.clock
+
+	def mark_all_modified(self):
+		# for changes which aren't tied to particular nodes
+		self.clock += 1
+		self.all_modified = self.clock
+
+	def modified_since(self, clock):
+		# returns the nodes which changed after the given tick, or None if
+		# every node may have changed
+		if self.all_modified > clock:
+			return None
+		return set(n for n, c in self.modified.items() if c > clock)
+	
 	def bbs(self):
 		return [node for node in self.nodes() 
 				if isinstance(node, hlir.BasicBlock)]
@@ -75,6 +75,9 @@ class FunctionIdentification(middleend.Optimization):
 			return None
 		self.absolute_offsets = set()
 
+		# every node is modified in place below
+		f.mark_all_modified()
+
 		# adjust the sp-delta of each node to 0
 		# we can't just use .adjust_sp_delta because we must do this for all
 		# nodes, not just BBs.
@@ -110,9 +113,8 @@ class FunctionIdentification(middleend.Optimization):
 		# now there should not be a single stack variable left.
 		def check(e):
 			assert (not isinstance(e, expr.Stack))
-			return e
 		for node in f.nodes():
-			utils.visit_and_modify_expressions(node, check)
+			utils.visit_expressions(node, check)
 
 		return fix
 		
@@ -134,9 +136,8 @@ class FunctionIdentification(middleend.Optimization):
 					total_offset = n.offset + offset
 					if total_offset < self.result:
 						self.result = total_offset
-				return n
 
-			utils.visit_and_modify_expressions(n, visit)
+			utils.visit_expressions(n, visit)
 
 			if n in reachable_rets:
 				continue
@@ -211,8 +212,7 @@ class FunctionIdentification(middleend.Optimization):
 
 		# for any BB that jumps to h but which is not reachable from h,
 		# figure out which value it puts at the delta
-		node_addrs = {node.address: node 
-					  for node in self.function.nodes()}
+		node_addrs = self.function.get_nodes_by_addr()
 		ret_addrs = {}
 		preds = h.get_predecessors()
 		stack_positions = set()
@@ -18,11 +18,19 @@ class HLIRNode(draw.Node):
 		self.add_successor(new)
 		self.remove_successor(old)
 
+	def mark_modified(self):
+		# must be called on every change to the node, see
+		# Function.mark_modified
+		if self.function:
+			self.function.mark_modified(self)
+
 	def add_successor(self, succ):
 		self.__successors.add(succ)
 		succ.__predecessors.add(self)
 		if self.function:
 			self.function.invalidate_cached_nodes()
+		self.mark_modified()
+		succ.mark_modified()
 	
 	def successor(self):
 		assert (len(self.__successors) == 1)
@@ -33,6 +41,8 @@ class HLIRNode(draw.Node):
 		succ.__predecessors.remove(self)
 		if self.function:
 			self.function.invalidate_cached_nodes()
+		self.mark_modified()
+		succ.mark_modified()
 	
 	def get_successors(self):
 		return set(self.__successors)
@@ -40,6 +50,12 @@ class HLIRNode(draw.Node):
 	def get_predecessors(self):
 		return set(self.__predecessors)
 
+	def num_successors(self):
+		return len(self.__successors)
+
+	def num_predecessors(self):
+		return len(self.__predecessors)
+
 class BasicBlock(HLIRNode):
 	def __init__(self, addr, instrs, sp_delta):
 		HLIRNode.__init__(self)
@@ -52,11 +68,22 @@ class BasicBlock(HLIRNode):
 		self.function = None
 		self.terminator = None
 
+	@property
+	def terminator(self):
+		return self.__terminator
+
+	@terminator.setter
+	def terminator(self, ins):
+		self.__terminator = ins
+		self.mark_modified()
+
 	def remove_instruction(self, ins):
 		self.__instructions.remove(ins)
+		self.mark_modified()
 	
 	def insert_instruction(self, ins, offset=0):
 		self.__instructions.insert(offset, ins)
+		self.mark_modified()
 	
 	def replace_instruction(self, old, new):
 		index = self.__instructions.index(old)
@@ -106,9 +133,18 @@ class BasicBlock(HLIRNode):
 	
 	def append_instruction(self, ins):
 		self.__instructions.append(ins)
+		self.mark_modified()
 	
 	def adjust_sp_delta(self, delta):
 		self.sp_delta += delta
+		self.shift_stack_offsets(delta)
+
+	def shift_stack_offsets(self, delta):
+		# rebases the stack variables in the instructions (but not the
+		# terminator) onto an sp which is delta higher
+		self.mark_modified()
+		if delta == 0:
+			return
 		adjusted = set()
 		def fix(e):
 			if isinstance(e, expr.Stack) and id(e) not in adjusted:
@@ -125,23 +161,47 @@ class BasicBlock(HLIRNode):
 			utils.visit_and_modify_instruction(ins, fix)
 	
 	def merge(self, succ):
-		assert (self.terminator.type == ins_types.jump)
-		assert (self.terminator.loc.literal == succ.address)
+		self.merge_chain([succ])
+
+	def merge_chain(self, chain):
+		# merges the blocks of chain into this one, where every block only
+		# jumps to the next one. Each block is rebased onto the sp at the end
+		# of the chain at once, so that every instruction is visited once.
+		blocks = [self] + chain
+		for bb, succ in zip(blocks, chain):
+			assert (bb.terminator.type == ins_types.jump)
+			assert (bb.terminator.loc.literal == succ.address)
+
+		# the sp delta of the blocks which come after each block
+		later_deltas = []
+		delta = 0
+		for bb in reversed(blocks):
+			later_deltas.append(delta)
+			delta += bb.sp_delta
+		later_deltas.reverse()
+
+		instrs = []
+		for bb, later_delta in zip(blocks, later_deltas):
+			bb.shift_stack_offsets(later_delta)
+			instrs += bb.get_instructions()
+
+		last = chain[-1]
 		self.terminator = None
-		self.adjust_sp_delta(succ.sp_delta)
-		for ins in succ.get_instructions():
-			self.append_instruction(ins)
-		self.terminator = succ.terminator
+		self.__instructions = instrs
+		self.sp_delta = delta
+		self.terminator = last.terminator
 
-		self.next_bb = succ.next_bb
+		self.next_bb = last.next_bb
 
-		for ss in list(succ.get_successors()):
+		for ss in list(last.get_successors()):
 			self.add_successor(ss)
-			succ.remove_successor(ss)
-		self.remove_successor(succ)
+			last.remove_successor(ss)
+		for bb, succ in zip(blocks, chain):
+			bb.remove_successor(succ)
 
-		assert (len(succ.get_successors()) == 0)
-		assert (len(succ.get_predecessors()) == 0)
+		for bb in chain:
+			assert (len(bb.get_successors()) == 0)
+			assert (len(bb.get_predecessors()) == 0)
 
 
 ###################################
@@ -156,7 +216,9 @@ class ins_types:
 	ret = "ret"
 	assertion = "assertion"
 
-class Instruction:
+class Instruction(object):
+	__slots__ = ("type", "results", "args", "loc")
+
 	def __init__(self, type, results, args, location):
 		assert (isinstance(results, list))
 		assert (isinstance(args, list))
@@ -0,0 +1,229 @@
+import gc
+import time
+import resource
+
+import llir
+import hlir
+import absyn
+import contract
+
+# per-phase measurements for Decompiler.stats["phases"].
+#
+# every phase gets a record like:
+#
+# {
+#	name: "optimize",
+#	run: 0,                 (0 for the deployment code, 1 for the deployed code)
+#	wall_time: 1.23,
+#	cpu_time: 1.2,
+#	allocated_objects: 1234, (net change in gc-tracked objects)
+#	max_rss_kb: 12345,      (peak resident set size so far)
+#	num_functions: 3,       (the counts describe the phase's result)
+#	num_bbs: 123,
+#	num_instructions: 1234,
+# }
+
+def count_objects():
+	# python 2 has no tracemalloc, so count the objects tracked by the gc
+	return len(gc.get_objects())
+
+def count_ir(result):
+	counts = {}
+
+	if isinstance(result, contract.Contract):
+		counts["num_functions"] = len(result.functions)
+		counts["num_bbs"] = 0
+		counts["num_instructions"] = 0
+		for f in result.functions:
+			nodes = f.nodes()
+			counts["num_bbs"] += len(nodes)
+			for node in nodes:
+				if isinstance(node, hlir.BasicBlock):
+					# +1 for the terminator
+					counts["num_instructions"] += len(node.get_instructions()) + 1
+
+	elif isinstance(result, absyn.Contract):
+		counts["num_functions"] = len(result.functions)
+		counts["num_bbs"] = 0
+		counts["num_instructions"] = 0
+		for f in result.functions:
+			for node in f.nodes():
+				if isinstance(node, absyn.Sequence):
+					counts["num_bbs"] += 1
+					counts["num_instructions"] += len(node.instructions)
+
+	elif isinstance(result, list) and len(result) != 0:
+		if isinstance(result[0], llir.BasicBlock):
+			counts["num_bbs"] = len(result)
+			counts["num_instructions"] = sum(
+				len(bb.instructions) for bb in result)
+		elif isinstance(result[0], llir.Instruction):
+			counts["num_instructions"] = len(result)
+
+	return counts
+
+class PhaseRecorder:
+	def __init__(self, records, run):
+		self.records = records
+		self.run = run
+
+	def measure(self, name, func, *args):
+		# runs func(*args) and records its cost and the size of its result
+		return self.measure_counting(name, None, func, *args)
+
+	def measure_counting(self, name, counts_of, func, *args):
+		# like measure, but takes the counts from counts_of rather than from
+		# the result, for phases which modify their input
+		objects_before = count_objects()
+		cpu_before = time.clock()
+		wall_before = time.time()
+
+		result = func(*args)
+
+		wall_time = time.time() - wall_before
+		cpu_time = time.clock() - cpu_before
+		objects_after = count_objects()
+
+		record = {
+			"name": name,
+			"run": self.run,
+			"wall_time": wall_time,
+			"cpu_time": cpu_time,
+			"allocated_objects": objects_after - objects_before,
+			"max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		}
+
+		if counts_of is None:
+			counts_of = result
+		record.update(count_ir(counts_of))
+
+		self.records.append(record)
+		return result
+
+class OptimizationProfiler:
+	# records what the optimizer's fixpoint loop spends its time on. It is
+	# only used when settings.profile_optimizations is set.
+	#
+	# the trace is a list of events in the order they happened:
+	#
+	# {event: "pass", pass: "IntraBBDCE", function: "0x1a2", time: 0.01,
+	#  changed: true}
+	# {event: "skip", pass: "IntraBBDCE", function: "0x1a2"}
+	# {event: "sanity_checks", function: "0x1a2", time: 0.002}
+	# {event: "restart", function: "0x1a2", tier: "expensive",
+	#  passes: ["Rewrites"]}
+
+	def __init__(self):
+		self.trace = []
+
+		# (pass name, function address) -> counters
+		self.counters = {}
+
+	def function_name(self, f):
+		return "0x%x" % f.address
+
+	def get_counters(self, name, f):
+		key = (name, self.function_name(f))
+		if key not in self.counters:
+			self.counters[key] = {
+				"pass": name,
+				"function": key[1],
+				"invocations": 0,
+				"skipped": 0,
+				"changed": 0,
+				"unchanged": 0,
+				"time": 0.0,
+				"sanity_checks_time": 0.0,
+				"restarts": 0,
+			}
+		return self.counters[key]
+
+	def record_pass(self, name, f, time, changed):
+		c = self.get_counters(name, f)
+		c["invocations"] += 1
+		c["time"] += time
+		if changed:
+			c["changed"] += 1
+		else:
+			c["unchanged"] += 1
+
+		self.trace.append({
+			"event": "pass",
+			"pass": name,
+			"function": self.function_name(f),
+			"time": time,
+			"changed": changed,
+		})
+
+	def record_skip(self, name, f):
+		self.get_counters(name, f)["skipped"] += 1
+
+		self.trace.append({
+			"event": "skip",
+			"pass": name,
+			"function": self.function_name(f),
+		})
+
+	def record_sanity_checks(self, f, time):
+		# attributed to the pass that ran right before the checks
+		if self.trace and self.trace[-1]["event"] == "pass":
+			name = self.trace[-1]["pass"]
+		else:
+			name = "(none)"
+		self.get_counters(name, f)["sanity_checks_time"] += time
+
+		self.trace.append({
+			"event": "sanity_checks",
+			"function": self.function_name(f),
+			"time": time,
+		})
+
+	def record_restart(self, f, tier, passes):
+		for name in passes:
+			self.get_counters(name, f)["restarts"] += 1
+
+		self.trace.append({
+			"event": "restart",
+			"function": self.function_name(f),
+			"tier": tier,
+			"passes": list(passes),
+		})
+
+	def summary(self, per_function=False):
+		# the counters sorted by total time spent, either per pass or per
+		# pass and function
+		if per_function:
+			rows = [dict(c) for c in self.counters.values()]
+		else:
+			by_pass = {}
+			for c in self.counters.values():
+				if c["pass"] not in by_pass:
+					row = dict(c)
+					del row["function"]
+					by_pass[c["pass"]] = row
+					continue
+				row = by_pass[c["pass"]]
+				for k, v in c.items():
+					if k not in ("pass", "function"):
+						row[k] += v
+			rows = by_pass.values()
+
+		def total(row):
+			return row["time"] + row["sanity_checks_time"]
+		return sorted(rows, key=total, reverse=True)
+
+	def report(self):
+		columns = ["invocations", "skipped", "changed", "restarts", "time",
+				   "sanity_checks_time"]
+
+		out = "%-28s" % "pass"
+		out += "".join("%20s" % c for c in columns) + "\n"
+		for row in self.summary():
+			out += "%-28s" % row["pass"]
+			for c in columns:
+				if isinstance(row[c], float):
+					out += "%20.3f" % row[c]
+				else:
+					out += "%20d" % row[c]
+			out += "\n"
+		return out
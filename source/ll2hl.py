@@ -350,6 +350,15 @@ class Converter:
 		revert_node.terminator = hlir.make_vmcall(vmcall.vmcalls.revert, [], [])
 
 		bb_by_addr = {bb.address: bb for bb in bbs + [revert_node]}
+
+		# every indirect jump may go to the same nodes at this point
+		indirect_targets = []
+		def get_indirect_targets():
+			if len(indirect_targets) == 0:
+				indirect_targets.extend(
+					utils.compute_indirect_jump_successors(bbs))
+			return indirect_targets
+
 		for bb in bbs:
 			if len(bb.get_instructions()) == 0:
 				last_ins = None
@@ -360,11 +369,14 @@ class Converter:
 				target = last_ins.loc
 				if isinstance(target, expr.Lit):
 					if target.literal not in bb_by_addr:
-						target.literal = revert_node.address
+						# literals are shared, so they're replaced rather
+						# than modified
+						target = expr.Lit(revert_node.address)
+						last_ins.loc = target
 					succ = bb_by_addr[target.literal]
 					bb.add_successor(succ)
 				else:
-					for other in utils.compute_indirect_jump_successors(bbs):
+					for other in get_indirect_targets():
 						bb.add_successor(other)
 				bb.remove_instruction(last_ins)
 				bb.terminator = last_ins
@@ -375,11 +387,14 @@ class Converter:
 				target = last_ins.loc
 				if isinstance(target, expr.Lit):
 					if target.literal not in bb_by_addr:
-						target.literal = revert_node.address
+						# literals are shared, so they're replaced rather
+						# than modified
+						target = expr.Lit(revert_node.address)
+						last_ins.loc = target
 					succ = bb_by_addr[target.literal]
 					bb.add_successor(succ)
 				else:
-					for other in utils.compute_indirect_jump_successors(bbs):
+					for other in get_indirect_targets():
 						bb.add_successor(other)
 
 				bb.remove_instruction(last_ins)
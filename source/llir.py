@@ -158,7 +158,9 @@ for opcode, name in opcodes_table:
 
 # this class is for concrete instances of an instruction in a contract, so
 # that it has an address.
-class Instruction:
+class Instruction(object):
+	__slots__ = ("ins", "arg", "address", "bytecode")
+
 	def __init__(self, ins, arg, addr, bytecode):
 		self.ins = ins
 		self.arg = arg
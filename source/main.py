@@ -1,26 +1,51 @@
 import decompiler
+import batch
 import unittests
 import time
 import utils
 import sys
+import json
+import settings
+
+CHECK_LEVELS = {
+	"off": settings.CHECKS_OFF,
+	"incremental": settings.CHECKS_INCREMENTAL,
+	"full": settings.CHECKS_FULL,
+}
 
 def main():
 	if len(sys.argv) < 2:
-		print("Usage: %s <filename>" % sys.argv[0])
+		print("Usage: %s <filename> [--stats <stats.json>] "
+			"[--profile <trace.json>] [--checks off|incremental|full] "
+			"| test [--checks off|incremental|full] | batch" % sys.argv[0])
 		return
 	
 	filename = sys.argv[1]
 
+	options = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+
+	if "--checks" in options:
+		settings.check_level = CHECK_LEVELS[options["--checks"]]
+
 	if filename == "test":
+		# the test suite checks the IR thoroughly unless told otherwise
+		if "--checks" not in options:
+			settings.check_level = settings.CHECKS_FULL
 		unittests.run_tests()
 		return
 
+	if filename == "batch":
+		sys.exit(batch.main(sys.argv[2:]))
+
 	if ".json" in filename:
 		bytecode, _ = utils.parse_json(filename)
 	else:
 		contents = utils.read_file_contents(filename)
 		bytecode = utils.decode_bytecode(contents)
 
+	if "--profile" in options:
+		settings.profile_optimizations = 1
+
 	before = time.time()
 
 	d = decompiler.Decompiler()
@@ -31,6 +56,19 @@ def main():
 
 	print(code)
 
+	# per-phase timings and counters, see instrumentation.py
+	if "--stats" in options:
+		f = open(options["--stats"], "w")
+		json.dump(d.json_stats(ast), f, indent=1, sort_keys=True)
+		f.close()
+
+	# what the optimization passes cost, see instrumentation.py
+	if "--profile" in options:
+		sys.stderr.write(d.profiler.report())
+		f = open(options["--profile"], "w")
+		json.dump(d.profiler.trace, f)
+		f.close()
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import expr
+import utils
+
+# alias analysis for memory accesses.
+#
+# a mem access covers the half-open region [address, address + length).
+# Literal regions are compared by their bounds, without enumerating them.
+#
+# regions like mem[base + 0x20:+0x20] are split into a symbolic base and a
+# constant offset. Two regions with the same base are then compared by
+# their offsets -- but only if both are evaluated in the same state, since
+# the base may have changed between two different program points. Bases
+# are variables and the free memory pointer, which, like in
+# dataflow.ids_may_be_equal, is assumed never to be overwritten by a write
+# relative to itself.
+#
+# offsets are taken modulo 2**256, so that e.g. base + 0xff..ff is at offset
+# -1. Regions whose offset or length is too large to tell whether they wrap
+# around aren't compared symbolically.
+
+MAX_OFFSET = 2**64
+
+def literal_region(m):
+	# returns (start, end), or None if the region isn't literal
+	if isinstance(m.address, expr.Lit) and isinstance(m.length, expr.Lit):
+		start = m.address.literal
+		return start, start + m.length.literal
+	return None
+
+def split_address(e):
+	# returns (base, offset) such that e == base + offset (mod 2**256), with
+	# the offset in the signed range
+	if isinstance(e, expr.Add):
+		if isinstance(e.operand2, expr.Lit):
+			return e.operand1, signed_offset(e.operand2.literal)
+		if isinstance(e.operand1, expr.Lit):
+			return e.operand2, signed_offset(e.operand1.literal)
+	elif isinstance(e, expr.Sub):
+		if isinstance(e.operand2, expr.Lit):
+			return e.operand1, signed_offset(-e.operand2.literal)
+	return e, 0
+
+def signed_offset(value):
+	return utils.signed(value % 2**256)
+
+def is_base(e):
+	if isinstance(e, expr.Var):
+		return True
+	return isinstance(e, expr.Mem) and e.is_free_mem_ptr()
+
+def same_base(b1, b2):
+	if isinstance(b1, expr.Var):
+		return b1 is b2
+	return isinstance(b2, expr.Mem) and b2.is_free_mem_ptr()
+
+def symbolic_region(m):
+	# returns (base, start, end) relative to the base, or None
+	if not isinstance(m.length, expr.Lit):
+		return None
+	base, offset = split_address(m.address)
+	if not is_base(base):
+		return None
+	length = m.length.literal
+	if abs(offset) >= MAX_OFFSET or not 0 <= length < MAX_OFFSET:
+		return None
+	return base, offset, offset + length
+
+def regions_overlap(start1, end1, start2, end2):
+	# empty regions overlap nothing
+	return (start1 < end1 and start2 < end2
+			and start1 < end2 and start2 < end1)
+
+def may_alias(m1, m2, same_state=False):
+	# whether the mem accesses m1 and m2 may overlap. same_state says that
+	# both are evaluated in the same state, e.g. within one instruction.
+	r1 = literal_region(m1)
+	r2 = literal_region(m2)
+	if r1 is not None and r2 is not None:
+		return regions_overlap(r1[0], r1[1], r2[0], r2[1])
+
+	if same_state and r1 is None and r2 is None:
+		s1 = symbolic_region(m1)
+		s2 = symbolic_region(m2)
+		if s1 is not None and s2 is not None and same_base(s1[0], s2[0]):
+			return regions_overlap(s1[1], s1[2], s2[1], s2[2])
+
+	return True
@@ -1,9 +1,25 @@
 # must be defined before imports to avoid circularity issues..
 class Optimization:
+	# passes which only look at a node and its direct neighbours set this, so
+	# that they only revisit the nodes which changed since their last run.
+	is_node_local = False
+
 	def __init__(self, c):
 		self.contract = c
 		self.changed = False
 
+		# for node-local passes this is set by the optimizer to the nodes
+		# which may have changed since the pass last ran on the function, or
+		# None if every node should be visited
+		self.dirty_nodes = None
+
+	def nodes_to_visit(self, f):
+		nodes = f.nodes()
+		if self.dirty_nodes is None:
+			return list(nodes)
+		return [n for n in self.dirty_nodes if n in nodes]
+
+import time
 import utils
 import expr
 import hlir
@@ -15,31 +31,44 @@ import elimination
 import propagation
 import functionid
 import otheranalyses
+import funcmemo
+import settings
 
 
 class Optimizer:
 
-	def sanity_checks(self, f):
+	def sanity_checks(self, f, nodes=None):
+		# checks the given nodes of f, or all of them if nodes is None
 		f_nodes = set(f.nodes())
-		found_by_dfs = set(utils.dfs_ordering(f.header_node))
-		assert (f_nodes == found_by_dfs)
-
-		# for speedups
-		preds = {node: node.get_predecessors() for node in f_nodes}
-		succs = {node: node.get_successors() for node in f_nodes}
+		if nodes is None:
+			found_by_dfs = set(utils.dfs_ordering(f.header_node))
+			assert (f_nodes == found_by_dfs)
+			nodes = f_nodes
 
+			# BB addresses should be unique
+			seen_addrs = set()
+			for node in nodes:
+				assert (node.address not in seen_addrs)
+				seen_addrs.add(node.address)
+		else:
+			# removed nodes are gone, there is nothing to check about them
+			nodes = nodes & f_nodes
 
-		seen_addrs = set()
+			# BB addresses should be unique
+			addrs = {}
+			for node in f_nodes:
+				addrs.setdefault(node.address, []).append(node)
+			for node in nodes:
+				assert (len(addrs[node.address]) == 1)
 
-		for node in f_nodes:
+		# for speedups
+		preds = {node: node.get_predecessors() for node in nodes}
 
-			# BB addresses should be unique
-			assert (node.address not in seen_addrs)
-			seen_addrs.add(node.address)
+		for node in nodes:
 
 			# check preds/succs first
-			for succ in succs[node]:
-				assert (node in preds[succ])
+			for succ in node.get_successors():
+				assert (node in succ.get_predecessors())
 				assert (succ in f_nodes)
 				assert (succ.function == node.function)
 			for pred in preds[node]:
@@ -68,20 +97,35 @@ class Optimizer:
 		# check that no expression object appears in more than one
 		# instruction. Otherwise changing e.g. operand1 in (var123 + 0x55) may
 		# affect more than one instruction, which leads to subtle bugs.
+		# in incremental mode this only catches sharing among the checked
+		# nodes, which is where a transformation would have introduced it.
+		# variables, literals and global variables are shared on purpose.
 		seen = set()
 		def mark_seen(e):
-			if not isinstance(e, expr.Var):
+			if not isinstance(e, (expr.Var, expr.Lit, expr.GlobalVar)):
 				assert (id(e) not in seen)
 				seen.add(id(e))
-			return e
 
-		for node in f_nodes:
-			utils.visit_and_modify_expressions(node, mark_seen)
+		for node in nodes:
+			utils.visit_expressions(node, mark_seen)
 
-	def __init__(self, contract, hook=None):
+	def __init__(self, contract, hook=None, profiler=None):
 		self.changed = False
+		self.changed_by = []
 		self.contract = contract
 
+		# an instrumentation.OptimizationProfiler, or None
+		self.profiler = profiler
+
+		# (function, pass) -> the function's clock when the pass last ran,
+		# and when it last ran without changing anything
+		self.last_run = {}
+		self.clean_at = {}
+
+		# function -> its clock when it was last checked, for incremental
+		# sanity checks
+		self.last_checked = {}
+
 		if hook is None:
 			hook = lambda c: True
 		self.hook = hook
@@ -119,57 +163,153 @@ class Optimizer:
 			otheranalyses.BBMerging,
 			elimination.UnusedVariableElimination,
 		]
+		# only once everything else has settled, since propagation can't see
+		# through the variables value numbering introduces
+		self.last_analyses = []
+		if settings.value_numbering:
+			self.last_analyses.append(propagation.ValueNumbering)
+
+	def dirty_nodes(self, f, key):
+		if key not in self.last_run:
+			return None
+
+		nodes = f.modified_since(self.last_run[key])
+		if nodes is None:
+			return None
+
+		# node-local passes also look at the direct neighbours of a node
+		result = set(nodes)
+		for n in nodes:
+			result |= n.get_successors()
+			result |= n.get_predecessors()
+		return result
 
 	def apply_opt(self, _opt, f):
 		#print("running %s" % _opt)
-		checksum = f.checksum()
+		key = (f, _opt)
+
+		# a pass which didn't change anything won't do so the next time
+		# either, unless the function has changed in the meantime
+		if self.clean_at.get(key) == f.clock:
+			if self.profiler:
+				self.profiler.record_skip(_opt.__name__, f)
+			return False
+
 		opt = _opt(self.contract)
 		opt.hook = self.hook
+		if opt.is_node_local:
+			opt.dirty_nodes = self.dirty_nodes(f, key)
+
+		clock = f.clock
+		before = time.time()
 		opt.optimize(f)
+		opt_time = time.time() - before
+
+		if opt.changed and f.clock == clock:
+			# the pass didn't tell which nodes it changed
+			f.mark_all_modified()
+
+		self.last_run[key] = clock
+		if opt.changed:
+			self.clean_at.pop(key, None)
+		else:
+			self.clean_at[key] = f.clock
 
 		if opt.changed:
 			#print("YES: %s" % _opt)
 			self.hook(self.contract)
+			self.changed_by.append(_opt.__name__)
 		if not opt.changed:
-			new_checksum = f.checksum()
-			assert (new_checksum == checksum)
+			# every mutation ticks the function's clock
+			assert (f.clock == clock)
 		
 		self.changed |= opt.changed
 
+		if self.profiler:
+			self.profiler.record_pass(
+				_opt.__name__, f, opt_time, opt.changed)
+
+		return True
+
+	def nodes_to_check(self, f):
+		# the nodes changed since the last check and their neighbours, or
+		# None if the whole function must be checked
+		if f not in self.last_checked:
+			return None
+
+		nodes = f.modified_since(self.last_checked[f])
+		if nodes is None:
+			return None
+
+		result = set(nodes)
+		for n in nodes:
+			result |= n.get_successors()
+			result |= n.get_predecessors()
+		return result
+
+	def run_sanity_checks(self, f):
+		if settings.check_level == settings.CHECKS_OFF:
+			return
+
+		before = time.time()
+		if settings.check_level == settings.CHECKS_INCREMENTAL:
+			nodes = self.nodes_to_check(f)
+			if nodes is None or len(nodes) != 0:
+				self.sanity_checks(f, nodes)
+			self.last_checked[f] = f.clock
+		else:
+			self.sanity_checks(f)
+		if self.profiler:
+			self.profiler.record_sanity_checks(f, time.time() - before)
+
 	def optimize_until_fixed_point(self, f):
+		# the loader function is the whole contract at this point, so it is
+		# never worth memoizing
+		fingerprint = None
+		if settings.memoize_functions and f.address != 0x0:
+			fingerprint = funcmemo.memo.fingerprint(f)
+			if fingerprint and funcmemo.memo.restore(fingerprint, f):
+				self.hook(self.contract)
+				self.run_sanity_checks(f)
+				return
+
+		num_functions = len(self.contract.functions)
+		self.run_until_fixed_point(f)
+
+		# if new functions were split off then the result isn't just f
+		if fingerprint and len(self.contract.functions) == num_functions:
+			funcmemo.memo.store(fingerprint, f)
+
+	def run_until_fixed_point(self, f):
 		cheap_opts = [opt for opt in self.optimizations if opt.is_cheap]
 		expensive_opts = [opt for opt in self.optimizations if not opt.is_cheap]
 
-		while True:
-			self.changed = False
-
-			for opt in cheap_opts:
-				self.apply_opt(opt, f)
-				self.sanity_checks(f)
-			
-			if self.changed:
-				continue
-
-			for opt in expensive_opts:
-				self.apply_opt(opt, f)
-				self.sanity_checks(f)
-
-			if self.changed:
-				continue
+		tiers = [
+			("cheap", cheap_opts),
+			("expensive", expensive_opts),
+			("delayed", self.delayed_analyses),
+			("more_delayed", self.more_delayed_analyses),
+			("last", self.last_analyses),
+		]
 
-			for opt in self.delayed_analyses:
-				self.apply_opt(opt, f)
-				self.sanity_checks(f)
+		while True:
+			# a change in any tier restarts from the cheap optimizations
+			for tier, opts in tiers:
+				self.changed = False
+				self.changed_by = []
 
-			if self.changed:
-				continue
+				for opt in opts:
+					if self.apply_opt(opt, f):
+						self.run_sanity_checks(f)
 
-			for opt in self.more_delayed_analyses:
-				self.apply_opt(opt, f)
-				self.sanity_checks(f)
+				if self.changed:
+					break
 
 			if not self.changed:
 				break
+
+			if self.profiler:
+				self.profiler.record_restart(f, tier, self.changed_by)
 	
 	def optimize(self):
 		self.hook(self.contract)
@@ -1,6 +1,21 @@
+import utils
+import settings
+
+# numbers the nodes of an interval so that a node which reaches another
+# comes first, unless they reach each other. Nodes in the same SCC, and nodes
+# which don't reach each other, are ordered by a DFS from the interval header.
+#
+# this is computed from the SCCs of the interval rather than by comparing
+# pairs of nodes: Tarjan's algorithm emits an SCC when the DFS finishes its
+# first node, so the SCCs in reverse order are sorted topologically, and
+# SCCs which don't reach each other are in the order of the DFS.
+
 class NumberComputer:
-	
+
 	def reachable_nodes(self, n):
+		if n in self.reachable:
+			return self.reachable[n]
+
 		result = set()
 		stack = [n]
 		while len(stack) != 0:
@@ -9,16 +24,12 @@ class NumberComputer:
 			if node in result:
 				continue
 			result.add(node)
-			for succ in self.succ_func(node):
-				if succ in self.interval:
-					stack.append(succ)
-
-		# sanity check
-		for n in result:
-			assert (n in self.interval)
+			for succ in self.interval_successors(node):
+				stack.append(succ)
 
+		self.reachable[n] = result
 		return result
-	
+
 	def path_exists(self, a, b):
 		return b in self.reachable_nodes(a)
 
@@ -26,6 +37,11 @@ class NumberComputer:
 		self.interval = set([n for n in interval])
 		self.interval_header = interval[0]
 		self.numbering = {}
+		self.reachable = {}
+
+		# the DFS starts at the header; nodes it doesn't reach are visited
+		# afterwards, in the order they were given
+		self.roots = [self.interval_header] + interval
 
 		if succ_func is None:
 			self.succ_func = lambda n: n.get_successors()
@@ -33,50 +49,51 @@ class NumberComputer:
 			self.succ_func = succ_func
 
 		self.init_dfs_numbers()
-	
-	def dfs(self, n, seen):
-		if n in seen:
+
+	def interval_successors(self, n):
+		return [s for s in self.succ_func(n) if s in self.interval]
+
+	def dfs(self, root, seen):
+		if root in seen:
 			return
-		seen.add(n)
-		for succ in self.succ_func(n):
-			if succ in self.interval:
-				self.dfs(succ, seen)
-		self.dfs_number[n] = self.cur_dfs_num
-		self.cur_dfs_num -= 1
-	
+		seen.add(root)
+		stack = [(root, iter(self.interval_successors(root)))]
+		while len(stack) != 0:
+			n, succs = stack[-1]
+			for succ in succs:
+				if succ not in seen:
+					seen.add(succ)
+					stack.append((succ, iter(self.interval_successors(succ))))
+					break
+			else:
+				stack.pop()
+				self.dfs_number[n] = self.cur_dfs_num
+				self.cur_dfs_num -= 1
+
 	def init_dfs_numbers(self):
 		self.dfs_number = {}
 		self.cur_dfs_num = len(self.interval)
-		self.dfs(self.interval_header, set())
-	
-	def break_ties(self, a, b):
-		if a in self.dfs_number and b in self.dfs_number:
-			return self.dfs_number[b] - self.dfs_number[a]
-		else:
-			# TODO fix this.
-			return 0
-
-	def compare_nodes(self, a, b):
-		path_from_a_to_b = self.path_exists(a, b)
-		path_from_b_to_a = self.path_exists(b, a)
-
-		if path_from_a_to_b and path_from_b_to_a:
-			# it's a tie, so use their address to determine which is first
-			return self.break_ties(a, b)
-		
-		if path_from_a_to_b:
-			return 1
-		
-		if path_from_b_to_a:
-			return -1
-		
-		return self.break_ties(a, b)
+		seen = set()
+		for root in self.roots:
+			self.dfs(root, seen)
 
 	def compute_bb_numbering(self):
-		nodes = list(self.interval)
-		sorted_nodes = sorted(nodes, cmp=self.compare_nodes)
-		for i, node in enumerate(reversed(sorted_nodes)):
-			self.numbering[node] = i+1
+		sccs = utils.strongly_connected_components(self.roots,
+			self.interval_successors)
+		number = 1
+		for scc in reversed(sccs):
+			for node in sorted(scc, key=lambda n: self.dfs_number[n]):
+				self.numbering[node] = number
+				number += 1
+
+		if settings.check_level == settings.CHECKS_FULL:
+			self.sanity_check_order()
+
+	def sanity_check_order(self):
+		for a in self.interval:
+			for b in self.interval:
+				if self.path_exists(a, b) and not self.path_exists(b, a):
+					assert (self.numbering[a] < self.numbering[b])
 
 	def sanity_check_numbers(self):
 		assert (self.numbering[self.interval_header] == 1)
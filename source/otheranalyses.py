@@ -7,48 +7,72 @@ import vmcall
 import middleend
 import functionid
 import rewrites
+import settings
 
 class BBMerging(middleend.Optimization):
 	is_cheap = True
+	is_node_local = True
 
-	def optimize(self, f):
-		unprocessed = set(f.bbs())
-		while len(unprocessed) != 0:
-			bb = unprocessed.pop()
+	def mergeable_successor(self, bb):
+		# the successor which only bb jumps to and which can be merged into
+		# it, or None
+		if bb.terminator.type != hlir.ins_types.jump:
+			return None
+		if not isinstance(bb.terminator.loc, expr.Lit):
+			return None
 
-			if bb.terminator.type != hlir.ins_types.jump:
-				continue
-			if not isinstance(bb.terminator.loc, expr.Lit):
-				continue
+		if bb.num_successors() != 1:
+			return None
 
-			if len(bb.get_successors()) != 1:
-				continue
+		succ = bb.successor()
+		if succ.num_predecessors() != 1:
+			return None
 
-			succ = bb.successor()
-			if len(succ.get_predecessors()) != 1:
-				continue
-			assert (bb in succ.get_predecessors())
+		if succ == self.function.header_node:
+			return None
+		return succ
 
-			if succ == f.header_node:
-				continue
+	def optimize(self, f):
+		self.function = f
+		unprocessed = set(n for n in self.nodes_to_visit(f)
+						  if isinstance(n, hlir.BasicBlock))
+		while len(unprocessed) != 0:
+			bb = unprocessed.pop()
 
-			# sanity check: no other BB should be able to reach the successor
-			for node in f.nodes():
-				if node == bb:
-					continue
-				assert (succ not in node.get_successors())
+			# go back to the start of the chain, so that the whole chain is
+			# merged at once
+			seen = set([bb])
+			while bb.num_predecessors() == 1:
+				pred = next(iter(bb.get_predecessors()))
+				if pred in seen or self.mergeable_successor(pred) != bb:
+					break
+				seen.add(pred)
+				bb = pred
+
+			chain = []
+			succ = self.mergeable_successor(bb)
+			while succ is not None and succ != bb:
+				chain.append(succ)
+				succ = self.mergeable_successor(succ)
+				if succ in chain:
+					break
+
+			if len(chain) == 0:
+				continue
 
 			# now it's safe to merge them
 			self.changed = True
 
-			if succ in unprocessed:
-				unprocessed.remove(succ)
-			assert (succ not in unprocessed)
+			unprocessed.discard(bb)
+			for succ in chain:
+				unprocessed.discard(succ)
 
-			bb.merge(succ)
-			unprocessed.add(bb) # maybe we can merge again
+			bb.merge_chain(chain)
 
-			assert (succ not in f.nodes())
+			if settings.check_level == settings.CHECKS_FULL:
+				f_nodes = f.nodes()
+				for succ in chain:
+					assert (succ not in f_nodes)
 
 
 
@@ -70,16 +94,54 @@ class SuccessorReduction(middleend.Optimization):
 	def compute_indirect_jump_successors(self):
 		return utils.compute_indirect_jump_successors(list(self.function.nodes()))
 	
-	# use the backwards reach for this.
-	def compute_succs_for_node(self, n):
-		backwards_reach = n._reachable_nodes(lambda x: x.get_predecessors())
-		return utils.compute_indirect_jump_successors(
-			list(self.function.nodes()),
-			list(backwards_reach)
-		)
+	# use the backwards reach for this: an indirect jump may go to every
+	# address pushed by a node which can reach it.
+	def compute_indirect_targets(self, jumps):
+		# returns node -> its possible successors, for the given nodes with
+		# indirect jumps. The backwards reaches are computed for all of them
+		# at once: in the SCCs of the predecessor graph, the targets of an
+		# SCC are those pushed in it plus those of the SCCs it reaches.
+		valid_addresses = utils.jump_target_addresses(self.function.nodes())
+		sccs = utils.strongly_connected_components(jumps,
+			lambda x: x.get_predecessors())
+
+		scc_of = {}
+		targets = []
+		for i, scc in enumerate(sccs):
+			for n in scc:
+				scc_of[n] = i
+
+			pushed = set()
+			reached = set()
+			for n in scc:
+				pushed |= utils.pushed_jump_targets(n, valid_addresses)
+				for p in n.get_predecessors():
+					if scc_of[p] != i:
+						reached.add(scc_of[p])
+
+			if len(pushed) == 0 and len(reached) == 1:
+				# share the set rather than copying it along chains of nodes
+				targets.append(targets[reached.pop()])
+				continue
+			for j in reached:
+				pushed |= targets[j]
+			targets.append(pushed)
+
+		result = {}
+		for n in jumps:
+			assert (len(targets[scc_of[n]]) != 0)
+			result[n] = targets[scc_of[n]]
+		return result
 
 	def optimize(self, f):
 		self.function = f
+		nodes_by_addr = f.get_nodes_by_addr()
+
+		jumps = [node for node in f.nodes()
+				 if node.terminator.type in [hlir.ins_types.jump,
+											 hlir.ins_types.jcond]
+				 and isinstance(node.terminator.loc, expr.Id)]
+		indirect_targets = self.compute_indirect_targets(jumps)
 
 		# use two rounds; 
 		# in the first round, compute the new successors for all nodes. 
@@ -94,12 +156,12 @@ class SuccessorReduction(middleend.Optimization):
 										hlir.ins_types.jcond]:
 				if isinstance(node.terminator.loc, expr.Lit):
 					addr = node.terminator.loc.literal
-					try:
-						succs = set([utils.get_node_by_addr(f.nodes(), addr)])
-					except KeyError:
+					if addr in nodes_by_addr:
+						succs = set([nodes_by_addr[addr]])
+					else:
 						succs = set()
 				elif isinstance(node.terminator.loc, expr.Id):
-					succs = self.compute_succs_for_node(node)
+					succs = set(indirect_targets[node])
 				else:
 					# otherwise it may be improved via constant folding
 					continue
@@ -122,17 +184,32 @@ class SuccessorReduction(middleend.Optimization):
 
 class Rewrites(middleend.Optimization):
 	is_cheap = False
+	is_node_local = True
 
 	def optimize(self, f):
-		while True:
-			progress = False
-			for node in list(f.nodes()):
-				result = rewrites.rewrite_node(node)
-				progress |= result
-				self.changed |= result
+		# a rewrite only ever enables further rewrites in the node itself and
+		# its neighbours, so those are all we need to revisit.
+		worklist = self.nodes_to_visit(f)
+		queued = set(worklist)
+		while len(worklist) != 0:
+			node = worklist.pop()
+			queued.remove(node)
+
+			if node not in f.nodes():
+				continue
+
+			if not rewrites.rewrite_node(node):
+				continue
+
+			# expressions are rewritten in place
+			node.mark_modified()
+			self.changed = True
 
-			if not progress:
-				break
+			neighbours = node.get_successors() | node.get_predecessors()
+			for n in [node] + list(neighbours):
+				if n not in queued:
+					queued.add(n)
+					worklist.append(n)
 
 # in the loader code, we often see this pattern:
 # jcond (!x, R); R: revert(0, 0);
@@ -140,9 +217,10 @@ class Rewrites(middleend.Optimization):
 # we can merge and get fewer BBs.
 class AssertReconstruction(middleend.Optimization):
 	is_cheap = True
+	is_node_local = True
 
 	def optimize(self, f):
-		for bb in f.nodes():
+		for bb in self.nodes_to_visit(f):
 			if bb.terminator.type != hlir.ins_types.jcond:
 				continue
 			if not isinstance(bb.terminator.loc, expr.Lit):
@@ -166,7 +244,7 @@ class AssertReconstruction(middleend.Optimization):
 
 				return False
 
-			taken = utils.get_node_by_addr(f.nodes(), bb.terminator.loc.literal)
+			taken = f.get_nodes_by_addr()[bb.terminator.loc.literal]
 			fallthrough = bb.next_bb
 
 			if is_revert(taken):
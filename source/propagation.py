@@ -2,11 +2,12 @@ import middleend
 import hlir
 import expr
 import dataflow
+import ssa
 import utils
 import vmcall
 
 class Propagation(middleend.Optimization):
-	def safe_to_propagate(self, use_point, definition, paths):
+	def can_be_propagated(self, definition):
 		# first we must check the instruction type
 		def_ins = definition.point.ins
 		if def_ins.type != hlir.ins_types.assign:
@@ -25,6 +26,14 @@ class Propagation(middleend.Optimization):
 				if dataflow.ids_may_be_equal(lhs_var, r, same_bb=True):
 					return False
 
+		return True
+
+	def safe_to_propagate(self, use_point, definition, paths, region):
+		if not self.can_be_propagated(definition):
+			return False
+
+		lhs_var = definition.point.ins.results[0]
+
 		# then check if the RHS of the definition is ever redefined along any
 		# path from def to use.
 
@@ -81,6 +90,7 @@ class Propagation(middleend.Optimization):
 
 			explorer.next_nodes = next_nodes
 			explorer.explore()
+			region |= explorer.visited
 
 			if not self.result:
 				return False
@@ -89,13 +99,86 @@ class Propagation(middleend.Optimization):
 		return True
 	
 	
+	def find_definition(self, ident, use_point):
+		# returns the single definition of ident which can be propagated to
+		# the use point along with the sp offset between them, or None
+		if self.dataflow is None:
+			self.dataflow = dataflow.get_dataflow(self.function)
+
+		# the uses which took a walk through the function to turn down are
+		# remembered until a node on that walk changes
+		key = ("propagate", id(use_point.ins), id(ident))
+		if self.dataflow.known_negative(key):
+			return None
+
+		region = set()
+		res = self.search_definition(ident, use_point, region)
+		if res is None and len(region) != 0:
+			self.dataflow.add_negative(key, region, (use_point.ins, ident))
+		return res
+
+	def search_definition(self, ident, use_point, region):
+		# the nodes looked at by the expensive checks are added to region
+		if self.ssa is not None and isinstance(ident, expr.Var):
+			definition = self.ssa.reaching_definition(ident, use_point)
+			if definition is None:
+				return None
+			if not self.can_be_propagated(definition):
+				return None
+
+			unchanged = self.ssa.rhs_unchanged(definition, use_point)
+			if unchanged is None:
+				# the RHS reads memory or storage
+				sp_offset = self.dataflow.available_at(definition, use_point,
+					region)
+				if sp_offset is None:
+					return None
+				return definition, sp_offset
+			if not unchanged:
+				return None
+			return definition, 0
+
+		if self.dataflow.handles(ident):
+			defs = self.dataflow.reaching_definitions(ident, use_point)
+			if len(defs) != 1 or defs[0] is None:
+				return None
+			definition = defs[0]
+
+			if not self.can_be_propagated(definition):
+				return None
+
+			# check that the RHS is not redefined on the way, for all paths
+			# at once
+			sp_offset = self.dataflow.available_at(definition, use_point,
+				region)
+			if sp_offset is None:
+				return None
+			return definition, sp_offset
+
+		# mem, and stack variables in functions without fixed stack heights,
+		# are left to the explorer
+		res = dataflow.get_certain_definitions(ident, use_point, region)
+		if res is None:
+			return None
+		paths, defs = res
+		defining_nodes = set([path[-1] for path in paths])
+		if len(defining_nodes) != 1:
+			return None
+
+		definition, sp_offset = next(iter(defs.items()))
+
+		if not self.safe_to_propagate(use_point, definition, paths, region):
+			return None
+		return definition, sp_offset
+	
 	def propagate_id(self, ident, use_point):
 		if not isinstance(ident, expr.Id):
 			return ident
 
 		# for now only handle propagation of some types
 		if isinstance(ident, expr.Var):
-			pass
+			if ident.pinned:
+				return ident
 		elif isinstance(ident, expr.Mem):
 			pass
 		elif isinstance(ident, expr.Stack):
@@ -109,18 +192,10 @@ class Propagation(middleend.Optimization):
 		if ident in self.function.params:
 			return ident
 
-		res = dataflow.get_certain_definitions(ident, use_point)
+		res = self.find_definition(ident, use_point)
 		if res is None:
 			return ident
-		paths, defs = res
-		defining_nodes = set([path[-1] for path in paths])
-		if len(defining_nodes) != 1:
-			return ident
-
-		definition, sp_offset = next(iter(defs.items()))
-
-		if not self.safe_to_propagate(use_point, definition, paths):
-			return ident
+		definition, sp_offset = res
 
 		# it's safe to propagate; do so.
 
@@ -139,6 +214,9 @@ class Propagation(middleend.Optimization):
 		value = definition.point.ins.args[0]
 		self.changed = True
 
+		# the use is modified in place
+		use_point.node.mark_modified()
+
 		# if we're propagating a stack variable, we need to adjust its offset
 		def fix(e):
 			if isinstance(e, expr.Stack):
@@ -165,6 +243,10 @@ class InterBBPropagation(Propagation):
 	is_cheap = False
 	def optimize(self, f):
 		self.function = f
+		self.dataflow = None
+		self.ssa = None
+		if f.flattened:
+			self.ssa = ssa.SSAForm(f)
 
 		self.pending_replacements = []
 
@@ -185,6 +267,8 @@ class IntraBBPropagation(Propagation):
 	is_cheap = True
 	def optimize(self, f):
 		self.function = f
+		self.dataflow = None
+		self.ssa = None
 
 		self.pending_replacements = []
 
@@ -207,11 +291,14 @@ would be okay to propagate. So we handle this case here.
 """
 class InsPairUnification(middleend.Optimization):
 	is_cheap = True
+	is_node_local = True
 	def optimize(self, f):
-		for node in f.nodes():
+		for node in self.nodes_to_visit(f):
 			for ins1, ins2 in utils.instruction_pairs(node):
 				if ins1.type != hlir.ins_types.assign:
 					continue
+				if isinstance(ins1.results[0], expr.Var) and ins1.results[0].pinned:
+					continue
 
 				if ins2.type == hlir.ins_types.assign:
 					id1, id2 = ins1.results[0], ins2.results[0]
@@ -249,3 +336,419 @@ class InsPairUnification(middleend.Optimization):
 					node.remove_instruction(ins1)
 					break
 
+
+
+"""
+Propagation copies the same expressions into many places, e.g. address
+masks, free memory pointer loads and sha3 keys. This binds structurally equal,
+side-effect-free expressions which compute the same value to a single
+variable:
+
+1:        foo(sha3((param0, 0x1)));
+2:        storage(sha3((param0, 0x1))) = 0x0;
+
+becomes
+
+1:        var0 = sha3((param0, 0x1));
+2:        foo(var0);
+3:        storage(var0) = 0x0;
+
+Expressions are given value numbers: two expressions get the same number if
+they have the same structure, up to the order of the operands of commutative
+operators, and their variables have the same SSA values.
+An expression is then replaced by the variable bound at an earlier occurrence
+which dominates it.
+
+memory and storage reads are only numbered within a BB, and only until the
+next instruction which may write memory or storage. Functions which aren't
+flattened have no SSA form, so their variables are numbered within a BB too;
+this also keeps every binding in the BB of its uses, which matters as long as
+FunctionIdentification may still move BBs to other functions.
+
+the bound variables are pinned, so that propagation doesn't undo this. When
+the first occurrence is already the whole RHS of a variable's assignment,
+that variable is pinned and reused instead of binding a new one, and a
+variable which ends up assigned another variable is unpinned, so that copy
+propagation removes the copy.
+"""
+class ValueClass:
+	# the occurrences of expressions with the same value number which are
+	# dominated by the first one
+	def __init__(self, size):
+		self.size = size
+		self.occurrences = []
+		self.var = None
+
+class Occurrence:
+	def __init__(self, value_class, e, node, ins, parent):
+		self.value_class = value_class
+		self.expr = e
+		self.node = node
+		self.ins = ins
+
+		# the closest occurrence which contains this one, or None
+		self.parent = parent
+
+		# set when this occurrence is replaced by a variable
+		self.removed = False
+
+class ValueNumbering(middleend.Optimization):
+	is_cheap = False
+
+	# the expressions worth binding to a variable
+	candidate_types = (expr.BinaryOp, expr.UnaryOp, expr.PureFunctionCall,
+		expr.Mem, expr.Storage, expr.NamedStorageAccess)
+
+	state_types = (expr.Mem, expr.Storage, expr.NamedStorageAccess)
+
+	# global variables which may change within a transaction
+	volatile_globals = ["msg.gas"]
+
+	def optimize(self, f):
+		self.function = f
+		self.ssa = None
+		if f.flattened:
+			self.ssa = ssa.SSAForm(f)
+
+		self.numbers = {} # key -> value number
+		self.local_numbers = set() # the numbers which only hold within a BB
+		self.classes = []
+
+		if self.ssa is None:
+			for node in f.nodes():
+				self.number_node(node, {})
+		else:
+			self.number_dominator_tree(f)
+
+		actions = self.select_classes()
+		if len(actions) != 0:
+			self.bind(actions)
+
+	def number_dominator_tree(self, f):
+		children = self.ssa.dominators.children
+
+		# the classes available in a node are those of its dominators
+		available = {}
+		stack = [(f.header_node, None)]
+		while len(stack) != 0:
+			node, added = stack.pop()
+			if node is None:
+				for number in added:
+					del available[number]
+				continue
+
+			added = self.number_node(node, available)
+			stack.append((None, added))
+			for c in sorted(children[node], key=lambda n: n.address):
+				stack.append((c, None))
+
+	def number_node(self, node, available):
+		# numbers the expressions in node and returns the value numbers it
+		# made available to the nodes it dominates
+		self.node = node
+		self.available = available
+		self.local = {} # number -> ValueClass, for local numbers
+		self.added = []
+
+		# state reads are numbered along with the number of writes so far
+		self.epoch = 0
+
+		# var -> its SSA value, or the number of definitions so far in this
+		# BB without SSA form
+		self.current = {}
+
+		for ins in node.get_instructions() + [node.terminator]:
+			if not utils.is_unused(ins):
+				for root in self.rvalues(ins):
+					self.number_tree(root, ins)
+
+			for r in ins.results:
+				if not isinstance(r, expr.Var):
+					continue
+				if self.ssa is None:
+					self.current[r] = self.current.get(r, 0) + 1
+				elif not utils.is_unused(ins):
+					self.current[r] = self.ssa.defs[(id(ins), r)]
+
+			if self.may_write_state(ins):
+				self.epoch += 1
+
+		return self.added
+
+	def rvalues(self, ins):
+		result = list(ins.args)
+		for r in ins.results:
+			for child_name in r.child_names:
+				result.append(getattr(r, child_name))
+		return result
+
+	def may_write_state(self, ins):
+		if ins.type == hlir.ins_types.assign:
+			pass
+		elif ins.type == hlir.ins_types.vmcall:
+			if ins.loc not in vmcall.pure_vmcalls:
+				return True
+		elif ins.type == hlir.ins_types.call:
+			return True
+		else:
+			return False
+		for r in ins.results:
+			if not isinstance(r, (expr.Var, expr.Stack)):
+				return True
+		return False
+
+	def number_tree(self, root, ins):
+		# (expression, index of its parent) in pre-order
+		entries = []
+		stack = [(root, -1)]
+		while len(stack) != 0:
+			e, parent = stack.pop()
+			index = len(entries)
+			entries.append((e, parent))
+			for child_name in e.child_names:
+				child = getattr(e, child_name)
+				if child.__class__ is list:
+					for c in child:
+						stack.append((c, index))
+				else:
+					stack.append((child, index))
+
+		# children come after their parents, so number them in reverse
+		numbers = {} # id(e) -> value number
+		sizes = [1] * len(entries)
+		for i in range(len(entries) - 1, -1, -1):
+			e, parent = entries[i]
+			numbers[id(e)] = self.value_number(e, numbers)
+			if parent != -1:
+				sizes[parent] += sizes[i]
+
+		occurrences = [None] * len(entries)
+		enclosing = [None] * len(entries)
+		for i, (e, parent) in enumerate(entries):
+			if parent != -1:
+				enclosing[i] = occurrences[parent] or enclosing[parent]
+			number = numbers[id(e)]
+			if number is None or not self.is_candidate(e):
+				continue
+			occurrences[i] = self.add_occurrence(number, e, ins, sizes[i],
+				enclosing[i])
+
+	def is_candidate(self, e):
+		if not isinstance(e, self.candidate_types):
+			return False
+		if isinstance(e, expr.Mem):
+			# other lengths are byte ranges rather than values
+			return isinstance(e.length, expr.Lit) and e.length.literal == 0x20
+		return True
+
+	def value_number(self, e, numbers):
+		# returns None for expressions which can't be numbered
+		cls = e.__class__
+		local = False
+		if cls is expr.Lit:
+			key = (cls, e.literal)
+		elif cls is expr.GlobalVar:
+			if e.name in self.volatile_globals:
+				return None
+			key = (cls, e.name)
+		elif cls is expr.Var:
+			if self.ssa is None:
+				key = (cls, e, self.current.get(e, 0))
+				local = True
+			else:
+				if e not in self.current:
+					self.current[e] = self.ssa.resolve(
+						self.ssa.value_at_entry(e, self.node))
+				key = (cls, self.copied_value(self.current[e]))
+		elif len(e.child_names) == 0:
+			# stack variables, unused values
+			return None
+		else:
+			children = []
+			for child_name in e.child_names:
+				child = getattr(e, child_name)
+				if child.__class__ is list:
+					child_numbers = tuple(numbers[id(c)] for c in child)
+					if None in child_numbers:
+						return None
+					children.append(child_numbers)
+					local |= any(n in self.local_numbers for n in child_numbers)
+				else:
+					number = numbers[id(child)]
+					if number is None:
+						return None
+					children.append(number)
+					local |= number in self.local_numbers
+
+			if getattr(e, "is_commutative", False):
+				# (a & b) and (b & a) have the same value
+				children.sort()
+
+			if isinstance(e, expr.NamedStorageAccess):
+				attrs = e.num
+			elif cls is expr.PureFunctionCall:
+				attrs = e.name
+			else:
+				attrs = None
+
+			key = (cls, attrs, tuple(children))
+			if isinstance(e, self.state_types):
+				key += (self.epoch,)
+				local = True
+
+		number = self.numbers.get(key)
+		if number is None:
+			number = len(self.numbers)
+			self.numbers[key] = number
+			if local:
+				self.local_numbers.add(number)
+		return number
+
+	def copied_value(self, value):
+		# looks through copies of other variables to the value they copy
+		seen = set()
+		while value.is_definition() and value not in seen:
+			seen.add(value)
+			ins = value.ins
+			if ins.type != hlir.ins_types.assign or len(ins.results) != 1:
+				break
+			if not isinstance(ins.args[0], expr.Var):
+				break
+			point = dataflow.ProgramPoint(value.node, ins)
+			value = self.ssa.value_at(ins.args[0], point)
+		return value
+
+	def add_occurrence(self, number, e, ins, size, parent):
+		if number in self.local_numbers:
+			table = self.local
+		else:
+			table = self.available
+
+		value_class = table.get(number)
+		if value_class is None:
+			value_class = ValueClass(size)
+			self.classes.append(value_class)
+			table[number] = value_class
+			if table is self.available:
+				self.added.append(number)
+
+		result = Occurrence(value_class, e, self.node, ins, parent)
+		value_class.occurrences.append(result)
+		return result
+
+	def is_covered(self, occurrence):
+		# whether the occurrence is inside one which is replaced
+		parent = occurrence.parent
+		while parent is not None:
+			if parent.removed:
+				return True
+			parent = parent.parent
+		return False
+
+	def select_classes(self):
+		# returns id(e) -> (ValueClass, whether e becomes the definition)
+		# for the occurrences to replace. The largest expressions go first,
+		# since binding one also binds everything inside it.
+		actions = {}
+		classes = [c for c in self.classes if len(c.occurrences) >= 2]
+		classes.sort(key=lambda c: c.size, reverse=True)
+		for value_class in classes:
+			first = value_class.occurrences[0]
+			if self.is_covered(first):
+				# the remaining occurrences may not be dominated by a single
+				# one of them
+				continue
+			occurrences = [o for o in value_class.occurrences
+						   if not self.is_covered(o)]
+
+			# n occurrences of size s become a definition and n variables,
+			# so only bind them if that shrinks the IR
+			n, size = len(occurrences), value_class.size
+			if n * size <= size + n + 1:
+				continue
+
+			var = self.holder(first)
+			if var is not None and all(self.holds_value(var, first, o)
+									   for o in occurrences[1:]):
+				# reuse the variable; the first occurrence stays its value
+				value_class.var = var
+			else:
+				value_class.var = expr.Var()
+				actions[id(first.expr)] = (value_class, True)
+			value_class.var.pinned = True
+			for o in occurrences[1:]:
+				o.removed = True
+				actions[id(o.expr)] = (value_class, False)
+		return actions
+
+	def holder(self, occurrence):
+		# the variable assigned the occurrence, if it is a whole RHS
+		ins = occurrence.ins
+		if ins.type != hlir.ins_types.assign or utils.is_unused(ins):
+			return None
+		if ins.args[0] is not occurrence.expr or len(ins.results) != 1:
+			return None
+		result = ins.results[0]
+		if not isinstance(result, expr.Var):
+			return None
+		return result
+
+	def holds_value(self, var, first, o):
+		# whether var still has the value assigned at first when o is reached
+		if self.ssa is not None:
+			value = self.ssa.defs[(id(first.ins), var)]
+			point = dataflow.ProgramPoint(o.node, o.ins)
+			return self.ssa.value_at(var, point) is value
+
+		if o.node is not first.node:
+			return False
+		instrs = dataflow.get_instrs(o.node)
+		start = instrs.index(first.ins)
+		for ins in instrs[start + 1:instrs.index(o.ins)]:
+			if any(r is var for r in ins.results):
+				return False
+		return True
+
+	def bind(self, actions):
+		# the instructions with occurrences to replace
+		touched = []
+		seen = set()
+		for value_class in self.classes:
+			if value_class.var is None:
+				continue
+			for o in value_class.occurrences:
+				if id(o.expr) in actions and id(o.ins) not in seen:
+					seen.add(id(o.ins))
+					touched.append((o.node, o.ins))
+
+		for node, ins in touched:
+			definitions = []
+			def fix(e):
+				action = actions.get(id(e))
+				if action is None:
+					return e
+				value_class, is_definition = action
+				if is_definition:
+					# nested definitions are made first, in post-order
+					definitions.append(hlir.make_assign(value_class.var, e))
+				return value_class.var
+
+			utils.visit_and_modify_instruction(ins, fix, exclude_lhs=True)
+			node.mark_modified()
+
+			# a variable holding another one is just a copy of it
+			if ins.type == hlir.ins_types.assign and \
+					isinstance(ins.args[0], expr.Var):
+				for r in ins.results:
+					if isinstance(r, expr.Var):
+						r.pinned = False
+
+			if ins is node.terminator:
+				for d in definitions:
+					node.append_instruction(d)
+			else:
+				index = node.get_instructions().index(ins)
+				for i, d in enumerate(definitions):
+					node.insert_instruction(d, index + i)
+
+		self.changed = True
@@ -3,6 +3,7 @@ import utils
 import expr
 import vmcall
 import dataflow
+import consteval
 import addressdispenser
 
 ###########################################################################
@@ -268,16 +269,9 @@ def simplify_eq(node):
 		return expr.Lit(1)
 
 def fold_constants(node):
-	if (isinstance(node, expr.BinaryOp) 
-			and isinstance(node.operand1, expr.Lit) 
-			and isinstance(node.operand2, expr.Lit)):
-		result = expr.Lit(node.evaluate(None).num())
-		return result
-	
-	if (isinstance(node, expr.UnaryOp) 
-			and isinstance(node.operand, expr.Lit)):
-		result = expr.Lit(node.evaluate(None).num())
-		return result
+	value = consteval.fold(node)
+	if value is not None:
+		return expr.Lit(value)
 
 def fold_commutative_constants(node):
 	if not isinstance(node, expr.BinaryOp) or not node.is_commutative:
@@ -307,9 +301,11 @@ def simplify_plus_minus(node):
 		return a.operand2
 	
 	if isinstance(a.operand1, expr.Lit) and isinstance(b, expr.Lit):
-		return expr.Add(a.operand2, expr.Lit(a.operand1.literal - b.literal))
+		return expr.Add(a.operand2, expr.Lit(
+			consteval.evaluate_binary(expr.Sub, a.operand1.literal, b.literal)))
 	if isinstance(a.operand2, expr.Lit) and isinstance(b, expr.Lit):
-		return expr.Add(a.operand1, expr.Lit(a.operand2.literal - b.literal))
+		return expr.Add(a.operand1, expr.Lit(
+			consteval.evaluate_binary(expr.Sub, a.operand2.literal, b.literal)))
 
 def simplify_duplicate_and(node):
 	if not isinstance(node, expr.And):
@@ -370,7 +366,8 @@ def simplify_minus_minus(node):
 	a1, a2 = a.operand1, a.operand2
 	if not isinstance(a2, expr.Lit) or not isinstance(b, expr.Lit):
 		return
-	return expr.Sub(a1, expr.Lit(a2.literal + b.literal))
+	return expr.Sub(a1, expr.Lit(
+		consteval.evaluate_binary(expr.Add, a2.literal, b.literal)))
 
 def simplify_expr_seqs(node):
 	if not isinstance(node, expr.Sequence):
@@ -409,25 +406,47 @@ hlir_node_rewrites = [
 	jcond_not_not,
 ]
 
+# these rewrite expressions, and each applies to the given classes of
+# expressions and their subclasses
 expr_rewrites = [
-	fold_constants,
-	fold_commutative_constants,
-	simplify_plus_minus,
-	simplify_duplicate_and,
-	simplify_eq,
-	simplify_and,
-	simplify_mul,
-	simplify_div,
-	simplify_add,
-	simplify_minus,
-	simplify_minus_minus,
-	simplify_expr_seqs,
+	(fold_constants, [expr.BinaryOp, expr.UnaryOp]),
+	(fold_commutative_constants, [expr.BinaryOp]),
+	(simplify_plus_minus, [expr.Sub]),
+	(simplify_duplicate_and, [expr.And]),
+	(simplify_eq, [expr.Eq]),
+	(simplify_and, [expr.And]),
+	(simplify_mul, [expr.Mul]),
+	(simplify_div, [expr.Div]),
+	(simplify_add, [expr.Add]),
+	(simplify_minus, [expr.Sub]),
+	(simplify_minus_minus, [expr.Sub]),
+	(simplify_expr_seqs, [expr.Sequence]),
 
 	# TODO: move this to readability.. maybe?
-	detect_mapping_access,
-	detect_array_access,
+	(detect_mapping_access, [expr.Storage]),
+	(detect_array_access, [expr.Storage]),
 ]
 
+# class -> the expression rewrites which apply to it, in order
+rewrites_by_class = {}
+
+def get_expr_rewrites(cls):
+	if cls not in rewrites_by_class:
+		rewrites_by_class[cls] = [rewrite for rewrite, classes in expr_rewrites
+								  if issubclass(cls, tuple(classes))]
+	return rewrites_by_class[cls]
+
+def rewrite_expr(e):
+	# applies the first rewrite which matches e, and then rewrites its
+	# result, since that may match again. Returns None if nothing matched.
+	# The subexpressions of e have already been rewritten, so only what a
+	# rewrite returns needs another look.
+	for rewrite in get_expr_rewrites(e.__class__):
+		new = rewrite(e)
+		if new:
+			return utils.visit_and_modify(new, lambda n: rewrite_expr(n) or n)
+	return None
+
 def rewrite_node(node):
 	assert (isinstance(node, hlir.HLIRNode))
 
@@ -439,11 +458,7 @@ def rewrite_node(node):
 		#if r: print(rewrite)
 		result |= r
 	
-	# then rewrite any of its expressions
-	for rewrite in expr_rewrites:
-		r = utils.visit_and_modify_expressions(node, rewrite)
-		#if r: print(rewrite)
-		result |= r
+	# then rewrite all of its expressions, bottom-up in a single walk
+	result |= utils.visit_and_modify_expressions(node, rewrite_expr)
 	
 	return result
-	
@@ -5,3 +5,23 @@ simplify_bbs = 0
 simplify_free_mem_ptr = 0
 
 pretty_ast = 1
+
+# reuse the optimized bodies of functions seen before (see funcmemo.py)
+memoize_functions = 1
+
+# bind repeated side-effect-free expressions to variables (see
+# propagation.ValueNumbering)
+value_numbering = 0
+
+# record what every optimization pass costs (see instrumentation.py)
+profile_optimizations = 0
+
+# how thoroughly the IR is checked between transformations:
+# - CHECKS_OFF: never, for production runs
+# - CHECKS_INCREMENTAL: only the nodes which changed since the last check
+# - CHECKS_FULL: the whole function after every transformation
+CHECKS_OFF = 0
+CHECKS_INCREMENTAL = 1
+CHECKS_FULL = 2
+
+check_level = CHECKS_OFF
@@ -0,0 +1,199 @@
+import expr
+import utils
+import dataflow
+
+# SSA form for flattened functions.
+#
+# once a function is flattened every stack variable has become an expr.Var,
+# so it is an ordinary register program. This computes its SSA form: phis
+# are placed on the iterated dominance frontiers of each variable's
+# definitions, and every definition, phi and use is linked up into sparse
+# def-use chains. Propagation and DCE can then look up the single value
+# reaching a use, or whether a definition is ever used, without exploring
+# the graph.
+#
+# the SSA form is kept on the side rather than by renaming the variables in
+# the IR, so that the other passes, the function memo and the AST converter
+# never see it. Leaving SSA form is then just a matter of dropping it.
+#
+# like the reaching definitions in dataflow.py, ":= unused" assignments are
+# not definitions.
+
+class Value:
+	# an SSA value of a variable: a definition (ins is set), a phi (node is
+	# set, ins is None) or the value the variable has on entry to the
+	# function (both are None)
+	def __init__(self, var, node, ins):
+		self.var = var
+		self.node = node
+		self.ins = ins
+
+		# pred -> Value, for phis. The function entry is None.
+		self.operands = {}
+
+		# the instructions which use this value, and the phis which have it
+		# as an operand
+		self.uses = []
+		self.phi_uses = []
+
+	def is_definition(self):
+		return self.ins is not None
+
+	def is_phi(self):
+		return self.node is not None and self.ins is None
+
+def defined_vars(ins):
+	if utils.is_unused(ins):
+		return []
+	return [r for r in ins.results if isinstance(r, expr.Var)]
+
+def used_vars(ins):
+	return [e for e in dataflow.get_uses(ins) if isinstance(e, expr.Var)]
+
+class SSAForm:
+	def __init__(self, f):
+		assert (f.flattened)
+		self.function = f
+
+		self.nodes = f.nodes()
+		self.preds = {n: [p for p in n.get_predecessors() if p in self.nodes]
+					  for n in self.nodes}
+		self.dominators = f.dominators()
+		self.idom = self.dominators.idom
+		self.frontiers = self.dominators.get_frontiers()
+
+		self.entry_values = {} # var -> Value
+		self.defs = {} # (id(ins), var) -> Value
+		self.last_defs = {} # node -> {var: Value}
+		self.phis = {} # node -> {var: Value}
+
+		self.collect_definitions()
+		self.place_phis()
+		self.link_uses()
+		self.compute_liveness()
+
+	def collect_definitions(self):
+		self.def_sites = {} # var -> nodes
+		for node in self.nodes:
+			last = {}
+			for ins in dataflow.get_instrs(node):
+				for v in defined_vars(ins):
+					value = Value(v, node, ins)
+					self.defs[(id(ins), v)] = value
+					last[v] = value
+					self.def_sites.setdefault(v, set()).add(node)
+			self.last_defs[node] = last
+			self.phis[node] = {}
+
+	def place_phis(self):
+		for v, sites in self.def_sites.items():
+			worklist = list(sites)
+			placed = set()
+			while len(worklist) != 0:
+				node = worklist.pop()
+				for frontier in self.frontiers[node]:
+					if frontier in placed:
+						continue
+					placed.add(frontier)
+					self.phis[frontier][v] = Value(v, frontier, None)
+					if frontier not in sites:
+						worklist.append(frontier)
+
+	def value_at_entry(self, v, node):
+		# the value of v at the start of node
+		while node is not None:
+			if v in self.phis[node]:
+				return self.phis[node][v]
+			node = self.idom[node]
+			if node is not None and v in self.last_defs[node]:
+				return self.last_defs[node][v]
+
+		if v not in self.entry_values:
+			self.entry_values[v] = Value(v, None, None)
+		return self.entry_values[v]
+
+	def value_at_exit(self, v, node):
+		if v in self.last_defs[node]:
+			return self.last_defs[node][v]
+		return self.value_at_entry(v, node)
+
+	def link_uses(self):
+		for node in self.nodes:
+			for v, phi in self.phis[node].items():
+				for p in self.preds[node]:
+					phi.operands[p] = self.value_at_exit(v, p)
+				if node == self.function.header_node:
+					phi.operands[None] = self.value_at_entry(v, None)
+				for operand in phi.operands.values():
+					operand.phi_uses.append(phi)
+
+			current = {}
+			for ins in dataflow.get_instrs(node):
+				for v in used_vars(ins):
+					if v in current:
+						value = current[v]
+					else:
+						value = self.value_at_entry(v, node)
+					value.uses.append(ins)
+				for v in defined_vars(ins):
+					current[v] = self.defs[(id(ins), v)]
+
+	def compute_liveness(self):
+		# a value is live if an instruction uses it, or a live phi does
+		self.live = set()
+		worklist = [value for value in self.defs.values() if value.uses]
+		for phis in self.phis.values():
+			worklist += [phi for phi in phis.values() if phi.uses]
+
+		while len(worklist) != 0:
+			value = worklist.pop()
+			if value in self.live:
+				continue
+			self.live.add(value)
+			if value.is_phi():
+				worklist += value.operands.values()
+
+	def resolve(self, value):
+		# looks through phis whose operands are all the same value
+		seen = set()
+		while value.is_phi() and value not in seen:
+			seen.add(value)
+			operands = set(o for o in value.operands.values() if o != value)
+			if len(operands) != 1:
+				break
+			value = next(iter(operands))
+		return value
+
+	def value_at(self, v, point):
+		# the value of v right before the given instruction
+		instrs = dataflow.get_instrs(point.node)
+		index = instrs.index(point.ins)
+		for ins in reversed(instrs[:index]):
+			if (id(ins), v) in self.defs:
+				return self.resolve(self.defs[(id(ins), v)])
+		return self.resolve(self.value_at_entry(v, point.node))
+
+	def reaching_definition(self, v, point):
+		# the single definition of v which reaches the point, or None
+		value = self.value_at(v, point)
+		if not value.is_definition():
+			return None
+		return dataflow.Def(value.node, value.ins, v)
+
+	def is_live(self, v, def_point):
+		return self.defs[(id(def_point.ins), v)] in self.live
+
+	def rhs_unchanged(self, definition, use_point):
+		# whether every identifier in the RHS of the definition still has the
+		# same value at the use point. Only answers for RHSs made up of
+		# variables; returns None otherwise.
+		def_point = definition.point
+		for arg in def_point.ins.args:
+			for r in utils.visit_expr(arg):
+				if not isinstance(r, expr.Id):
+					continue
+				if not isinstance(r, expr.Var):
+					return None
+				if self.value_at(r, def_point) != self.value_at(r, use_point):
+					return False
+		return True
@@ -1,7 +1,11 @@
 import utils
 import log
 
-class Node:
+class Node(object):
+	# expressions are allocated by the million, so they have no __dict__;
+	# every subclass lists its attributes in __slots__
+	__slots__ = ()
+
 	def __str__(self):
 		result = str(self.__class__)
 		result += "(\n"
@@ -4,9 +4,33 @@ import sys
 import random
 import utils
 import struct
+import json
 from contract import Contract
 import absyn
 import os
+import settings
+import funcmemo
+import addressdispenser
+import middleend
+import instrumentation
+import expr
+import memalias
+import consteval
+import dominance
+import numbering
+import cfa
+import hlir
+import function
+import propagation
+import otheranalyses
+import ssa
+import elimination
+import dataflow
+import cache
+import batch
+import StringIO
+import tempfile
+import shutil
 
 JSON_PATH = "./tests/build/contracts/"
 BYTECODE_PATH = "./tests/bytecode/"
@@ -160,6 +184,771 @@ def pack_string_ref(s):
 		vs.append(0)
 	return vs
 
+def read_bytecode(filename):
+	contents = utils.read_file_contents(BYTECODE_PATH + filename)
+	return utils.decode_bytecode(contents)
+
+def optimize_contract(bytecode):
+	# the contract right after the optimizations, before the AST conversion
+	# replaces the callees of its calls
+	d = decompiler.Decompiler()
+	d.orig_bytecode = bytecode
+	d.phases = instrumentation.PhaseRecorder([], 0)
+	contract = d.front_end(utils.remove_swarm_hash(bytecode))
+	middleend.Optimizer(contract, None, None).optimize()
+	return contract
+
+def memo_encodings(contract):
+	result = {}
+	for f in contract.functions:
+		try:
+			result[f.address] = funcmemo.Encoder(f).encode(True)
+		except funcmemo.Uncacheable:
+			pass
+	return result
+
+def test_function_memo():
+	sys.stdout.write("funcmemo: ")
+	memoize_functions = settings.memoize_functions
+
+	# functions restored from the memo should be the same as when they are
+	# optimized
+	for filename in ["smallexample.bc", "mystery.bc"]:
+		bytecode = read_bytecode(filename)
+		settings.memoize_functions = 0
+		expected = memo_encodings(optimize_contract(bytecode))
+
+		settings.memoize_functions = 1
+		funcmemo.memo = funcmemo.FunctionMemo()
+		optimize_contract(bytecode)
+		hits = funcmemo.memo.hits
+		actual = memo_encodings(optimize_contract(bytecode))
+		assert (funcmemo.memo.hits > hits)
+		assert (len(expected) != 0 and actual == expected)
+		feedback(True)
+
+	# the external functions which eval3 copies have dispensed header
+	# addresses, so they can't be memoized, which must not stop the
+	# decompilation
+	d = decompiler.Decompiler()
+	contract, _, _ = d.decompile(read_bytecode("eval3.bc"))
+	copied = [f for f in contract.functions if f.header_node.address
+			  >= addressdispenser.FIRST_ADDRESS]
+	assert (len(copied) != 0)
+	for f in copied:
+		assert (funcmemo.memo.fingerprint(f) is None)
+	feedback(True)
+
+	settings.memoize_functions = memoize_functions
+	print("")
+
+def test_memalias():
+	sys.stdout.write("memalias: ")
+	x = expr.Var()
+	free_mem_ptr = expr.Mem(expr.Lit(0x40), expr.Lit(0x20))
+	def mem(address, length=0x20):
+		return expr.Mem(address, expr.Lit(length))
+
+	# (m1, m2, whether they may alias in the same state)
+	cases = [
+		(mem(expr.Lit(0x80)), mem(expr.Lit(0xa0)), False),
+		(mem(expr.Lit(0x80)), mem(expr.Lit(0x9f)), True),
+		(mem(expr.Lit(0x80), 0), mem(expr.Lit(0x80)), False),
+		(mem(x), mem(expr.Add(x, expr.Lit(0x20))), False),
+		(mem(x), mem(expr.Add(expr.Lit(0x1f), x)), True),
+		(mem(x), mem(expr.Sub(x, expr.Lit(0x20))), False),
+		(mem(x), mem(expr.Sub(x, expr.Lit(1))), True),
+		(mem(expr.Add(free_mem_ptr, expr.Lit(0x20))), mem(free_mem_ptr), False),
+
+		# offsets wrap around: x + 0xff..ff is x - 1
+		(mem(x), mem(expr.Add(x, expr.Lit(2**256 - 1))), True),
+		(mem(x), mem(expr.Add(x, expr.Lit(2**256 - 0x20))), False),
+		(mem(x), mem(expr.Sub(x, expr.Lit(2**256 - 1))), True),
+
+		# too far apart to tell
+		(mem(x), mem(expr.Add(x, expr.Lit(2**255))), True),
+		(mem(x, 2**255), mem(expr.Add(x, expr.Lit(2**255))), True),
+
+		# different bases
+		(mem(x), mem(expr.Add(expr.Var(), expr.Lit(0x20))), True),
+	]
+	for m1, m2, expected in cases:
+		assert (memalias.may_alias(m1, m2, True) == expected)
+		assert (memalias.may_alias(m2, m1, True) == expected)
+	feedback(True)
+
+	# symbolic regions are only compared in the same state
+	assert (memalias.may_alias(mem(x), mem(expr.Add(x, expr.Lit(0x20)))))
+	feedback(True)
+	print("")
+
+def test_consteval():
+	sys.stdout.write("consteval: ")
+	MAX = 2**256 - 1
+	INT_MIN = 2**255
+
+	# (op, a, b, expected)
+	binary_cases = [
+		(expr.Add, MAX, 1, 0),
+		(expr.Add, MAX, MAX, MAX - 1),
+		(expr.Add, -1, 2, 1), # out-of-range literals are wrapped first
+		(expr.Sub, 0, 1, MAX),
+		(expr.Sub, 5, 7, MAX - 1),
+		(expr.Mul, 2**255, 2, 0),
+		(expr.Exp, 2, 256, 0),
+		(expr.Exp, 3, 2, 9),
+		(expr.Div, 7, 2, 3),
+		(expr.Div, 7, 0, 0),
+		(expr.Mod, 7, 0, 0),
+		(expr.Mod, 7, 3, 1),
+		(expr.SDiv, MAX, 0, 0),
+		(expr.SDiv, INT_MIN, MAX, INT_MIN), # -2**255 / -1
+		(expr.SDiv, MAX - 6, 2, MAX - 2), # -7 / 2 truncates to -3
+		(expr.SDiv, 7, MAX - 1, MAX - 2), # 7 / -2
+		(expr.SDiv, MAX - 6, MAX - 1, 3), # -7 / -2
+		(expr.Lt, MAX, 0, 0),
+		(expr.SLt, MAX, 0, 1),
+		(expr.SGt, INT_MIN - 1, INT_MIN, 1),
+		(expr.Eq, MAX, -1, 1),
+		(expr.SignExtend, 0, 0x7f, 0x7f),
+		(expr.SignExtend, 0, 0x80, MAX - 0x7f),
+		(expr.SignExtend, 0, 0x1ff, MAX), # bits above the byte are dropped
+		(expr.SignExtend, 1, 0x8000, MAX - 0x7fff),
+		(expr.SignExtend, 30, 2**247, MAX - (2**247 - 1)),
+		(expr.SignExtend, 30, 2**247 - 1, 2**247 - 1),
+		(expr.SignExtend, 31, INT_MIN, INT_MIN),
+		(expr.SignExtend, 32, 0x80, 0x80),
+		(expr.SignExtend, MAX, 0x80, 0x80),
+	]
+	for op, a, b, expected in binary_cases:
+		result = consteval.evaluate_binary(op, a, b)
+		assert (result == expected)
+		assert (isinstance(result, int) or expected > sys.maxint)
+	feedback(True)
+
+	unary_cases = [
+		(expr.Not, 0, 1),
+		(expr.Not, MAX, 0),
+		(expr.Neg, 0, MAX),
+		(expr.Neg, MAX, 0),
+		(expr.Neg, -1, 0),
+	]
+	for op, a, expected in unary_cases:
+		assert (consteval.evaluate_unary(op, a) == expected)
+	feedback(True)
+
+	# operations which aren't evaluated
+	assert (consteval.evaluate_binary(expr.BinaryOp, 1, 2) is None)
+	assert (consteval.fold(expr.Add(expr.Var(), expr.Lit(1))) is None)
+	assert (consteval.fold(expr.Sub(expr.Lit(0), expr.Lit(1))) == MAX)
+	feedback(True)
+	print("")
+
+def test_dominance():
+	sys.stdout.write("dominance: ")
+	def graph(edges):
+		succs = {}
+		for a, b in edges:
+			succs.setdefault(a, []).append(b)
+			succs.setdefault(b, [])
+		preds = {n: [] for n in succs}
+		for a, b in edges:
+			preds[b].append(a)
+		return lambda n: succs[n], lambda n: preds[n]
+
+	# a diamond
+	succ, pred = graph([("a", "b"), ("a", "c"), ("b", "d"), ("c", "d")])
+	tree = dominance.DominatorTree("a", succ, pred)
+	assert (tree.idom == {"a": None, "b": "a", "c": "a", "d": "a"})
+	assert (sorted(tree.children["a"]) == ["b", "c", "d"])
+	assert (tree.get_frontiers() ==
+			{"a": set(), "b": set(["d"]), "c": set(["d"]), "d": set()})
+	post = dominance.post_dominator_tree(["a"], succ)
+	assert ([post.immediate(n) for n in "abcd"] == ["d", "d", "d", None])
+	feedback(True)
+
+	# a loop b -> c -> b, left from c
+	succ, pred = graph([("a", "b"), ("b", "c"), ("c", "b"), ("c", "d")])
+	tree = dominance.DominatorTree("a", succ, pred)
+	assert (tree.idom == {"a": None, "b": "a", "c": "b", "d": "c"})
+	assert (tree.get_frontiers() ==
+			{"a": set(), "b": set(["b"]), "c": set(["b"]), "d": set()})
+	post = dominance.post_dominator_tree(["a"], succ)
+	assert ([post.immediate(n) for n in "abcd"] == ["b", "c", "d", None])
+	feedback(True)
+
+	# an endless loop c <-> e, which isn't in the post-dominator tree, so
+	# all paths from a to an exit go through b
+	succ, pred = graph([("a", "b"), ("a", "c"), ("c", "e"), ("e", "c")])
+	post = dominance.post_dominator_tree(["a"], succ)
+	assert ("c" not in post.idom and "e" not in post.idom)
+	assert ([post.immediate(n) for n in "abce"] == ["b", None, None, None])
+	# nodes which aren't reachable from the root aren't in the tree either
+	tree = dominance.DominatorTree("c", succ, pred)
+	assert (tree.idom == {"c": None, "e": "c"})
+	feedback(True)
+
+	# multiple roots: only some paths from r2 go through x
+	succ, pred = graph([("r1", "x"), ("r2", "x"), ("r2", "y")])
+	post = dominance.post_dominator_tree(["r1", "r2"], succ)
+	assert (set(post.idom) - set(["r1", "r2", "x", "y"]) == set([post.root]))
+	assert ([post.immediate(n) for n in ["r1", "r2", "x", "y"]] ==
+			["x", None, None, None])
+	feedback(True)
+	print("")
+
+def test_numbering():
+	sys.stdout.write("numbering: ")
+	# h goes to an SCC {a, c} and to b, which don't reach each other; both
+	# go to d. Nodes which reach others come first, and the rest is in the
+	# order of a DFS from h, which visits successors in the given order.
+	def numbers(succs):
+		nc = numbering.NumberComputer(["h", "a", "b", "c", "d"],
+									  lambda n: succs[n])
+		nc.compute_bb_numbering()
+		nc.sanity_check_numbers()
+		return nc.numbering
+
+	succs = {"h": ["a", "b"], "a": ["c"], "c": ["a", "d"], "b": ["d"],
+			 "d": []}
+	assert (numbers(succs) == {"h": 1, "b": 2, "a": 3, "c": 4, "d": 5})
+	feedback(True)
+
+	# visiting b first puts the SCC before it
+	succs["h"] = ["b", "a"]
+	assert (numbers(succs) == {"h": 1, "a": 2, "c": 3, "b": 4, "d": 5})
+	feedback(True)
+
+	# the SCC is entered at c, so c comes before a
+	succs = {"h": ["c", "b"], "a": ["c", "d"], "c": ["a"], "b": ["d"],
+			 "d": []}
+	assert (numbers(succs) == {"h": 1, "b": 2, "c": 3, "a": 4, "d": 5})
+	feedback(True)
+	print("")
+
+def make_function(edges):
+	# a function whose BBs have the given numbers as addresses, with 1 as
+	# its header, and jumps and jconds to their successors
+	bbs = {}
+	for a, b in edges:
+		for n in [a, b]:
+			if n not in bbs:
+				bbs[n] = hlir.BasicBlock(n, [], 0)
+	f = function.Function(bbs[1], 0, 0, False)
+	for bb in bbs.values():
+		bb.function = f
+	for a, b in edges:
+		bbs[a].add_successor(bbs[b])
+	for n, bb in bbs.items():
+		succs = sorted(s for a, s in edges if a == n)
+		if len(succs) == 0:
+			bb.terminator = hlir.make_return([], None)
+		elif len(succs) == 1:
+			bb.terminator = hlir.make_jump(expr.Lit(succs[0]))
+		else:
+			bb.terminator = hlir.make_jcond(expr.Lit(succs[0]),
+											expr.Lit(1))
+	return f
+
+def test_loop_structuring():
+	sys.stdout.write("loops: ")
+	check_level = settings.check_level
+	settings.check_level = settings.CHECKS_FULL
+
+	# an outer loop 2 -> ... -> 5 -> 2 which is left for 6, and an inner
+	# loop 3 -> 4 -> 3 which is left for 5. 6 can also be reached from 1.
+	f = make_function([(1, 2), (1, 6), (2, 3), (2, 6), (3, 4), (4, 3),
+					   (4, 5), (5, 2)])
+	ls = cfa.LoopStructuring(f)
+
+	def partition(intervals):
+		result = {}
+		for interval in intervals:
+			bbs = set()
+			for node in interval:
+				bbs |= node.bbs
+			result[interval[0].header_bb.address] = set(
+				bb.address for bb in bbs)
+		return result
+
+	g = ls.make_initial_graph()
+	intervals = ls.find_intervals(g)
+	ls.sanity_check_intervals(intervals, g)
+	assert (partition(intervals) ==
+			{1: set([1]), 2: set([2]), 3: set([3, 4, 5]), 6: set([6])})
+	interval = [i for i in intervals if i[0].header_bb.address == 3][0]
+	reaching = ls.nodes_reaching_latching_nodes(interval)
+	assert (set(n.header_bb.address for n in interval if n in reaching)
+			== set([3, 4, 5]))
+	feedback(True)
+
+	# in the derived graph, the inner loop's interval is part of the outer
+	# loop's
+	g.collapse_intervals(intervals)
+	ls.sanity_check_graph(g)
+	intervals = ls.find_intervals(g)
+	ls.sanity_check_intervals(intervals, g)
+	assert (partition(intervals) ==
+			{1: set([1]), 2: set([2, 3, 4, 5]), 6: set([6])})
+
+	# and in the next one everything is a single interval
+	g.collapse_intervals(intervals)
+	intervals = ls.find_intervals(g)
+	assert (partition(intervals) == {1: set([1, 2, 3, 4, 5, 6])})
+	feedback(True)
+
+	loops = cfa.LoopStructuring(f).find_loops()
+	assert (set((l.header_node.address, l.follow_node.address,
+				 frozenset(bb.address for bb in l.nodes)) for l in loops) ==
+			set([(3, 5, frozenset([3, 4])), (2, 6, frozenset([2, 3, 4, 5]))]))
+	feedback(True)
+
+	settings.check_level = check_level
+	print("")
+
+def run_function(f, inputs):
+	# runs a function made by make_function whose instructions only assign
+	# variables, with the given values for the global variables. Returns
+	# the values it returns.
+	class State:
+		def __init__(self):
+			self.vars = {}
+		def lookup_var(self, v):
+			return self.vars[v]
+		def lookup_global(self, name):
+			return interpreter.Value(inputs[name])
+
+	state = State()
+	bbs = dict((bb.address, bb) for bb in f.nodes())
+	bb = f.header_node
+	while True:
+		for ins in bb.get_instructions():
+			if utils.is_unused(ins):
+				continue
+			assert (ins.type == hlir.ins_types.assign)
+			state.vars[ins.results[0]] = ins.args[0].evaluate(state)
+
+		ins = bb.terminator
+		if ins.type == hlir.ins_types.ret:
+			return [a.evaluate(state).num() for a in ins.args]
+		target = ins.loc.literal
+		if ins.type == hlir.ins_types.jcond:
+			if ins.args[0].evaluate(state).num() == 0:
+				# falls through to the other successor
+				target = [s.address for s in bb.get_successors()
+						  if s.address != target][0]
+		bb = bbs[target]
+
+def optimize_flattened(f):
+	# propagation and DCE with SSA form, until nothing changes
+	f.flattened = True
+	changed = True
+	while changed:
+		changed = False
+		for opt in [propagation.InterBBPropagation, elimination.InterBBDCE]:
+			o = opt(None)
+			o.optimize(f)
+			changed |= o.changed
+
+def test_ssa():
+	sys.stdout.write("ssa: ")
+	a = expr.GlobalVar("msg.value")
+	def point(bb, index):
+		return dataflow.ProgramPoint(bb, dataflow.get_instrs(bb)[index])
+
+	# v is redefined in one branch of a diamond, w isn't
+	f = make_function([(1, 2), (1, 3), (2, 4), (3, 4)])
+	f.flattened = True
+	bbs = dict((bb.address, bb) for bb in f.nodes())
+	v, w = expr.Var(), expr.Var()
+	bbs[1].append_instruction(hlir.make_assign(v, expr.Lit(1)))
+	bbs[1].append_instruction(hlir.make_assign(w, expr.Add(a, expr.Lit(5))))
+	bbs[1].terminator = hlir.make_jcond(expr.Lit(2), a)
+	bbs[2].append_instruction(hlir.make_assign(v, expr.Add(w, v)))
+	bbs[4].terminator = hlir.make_return([v, w], None)
+
+	form = ssa.SSAForm(f)
+	assert (dict((n.address, set(p)) for n, p in form.phis.items()) ==
+			{1: set(), 2: set(), 3: set(), 4: set([v])})
+	v1 = form.defs[(id(bbs[1].get_instructions()[0]), v)]
+	v2 = form.defs[(id(bbs[2].get_instructions()[0]), v)]
+	phi = form.phis[bbs[4]][v]
+	assert (phi.operands == {bbs[2]: v2, bbs[3]: v1})
+	assert (form.value_at(v, point(bbs[2], 0)) is v1)
+	assert (form.value_at(v, point(bbs[4], 0)) is phi)
+	assert (form.reaching_definition(v, point(bbs[4], 0)) is None)
+	definition = form.reaching_definition(w, point(bbs[4], 0))
+	assert (definition.point.ins is bbs[1].get_instructions()[1])
+	assert (form.is_live(w, definition.point))
+	feedback(True)
+
+	# out of SSA form, the code computes the same as before
+	results = [run_function(f, {"msg.value": i}) for i in [0, 1]]
+	assert (results == [[1, 5], [7, 6]])
+	optimize_flattened(f)
+	assert ([run_function(f, {"msg.value": i}) for i in [0, 1]] == results)
+	assert (bbs[4].terminator.args[1] is not w)
+	feedback(True)
+
+	# a loop 2 -> 3 -> 2 which counts i up to msg.value and sums it in s
+	f = make_function([(1, 2), (2, 3), (3, 2), (2, 4)])
+	f.flattened = True
+	bbs = dict((bb.address, bb) for bb in f.nodes())
+	i, s = expr.Var(), expr.Var()
+	bbs[1].append_instruction(hlir.make_assign(i, expr.Lit(0)))
+	bbs[1].append_instruction(hlir.make_assign(s, expr.Lit(0)))
+	bbs[2].terminator = hlir.make_jcond(expr.Lit(3), expr.Lt(i, a))
+	bbs[3].append_instruction(hlir.make_assign(s, expr.Add(s, i)))
+	bbs[3].append_instruction(hlir.make_assign(i, expr.Add(i, expr.Lit(1))))
+	bbs[4].terminator = hlir.make_return([s, i], None)
+
+	form = ssa.SSAForm(f)
+	assert (dict((n.address, set(p)) for n, p in form.phis.items()) ==
+			{1: set(), 2: set([i, s]), 3: set(), 4: set()})
+	i0 = form.defs[(id(bbs[1].get_instructions()[0]), i)]
+	i1 = form.defs[(id(bbs[3].get_instructions()[1]), i)]
+	phi = form.phis[bbs[2]][i]
+	assert (phi.operands == {bbs[1]: i0, bbs[3]: i1})
+	assert (form.value_at(i, point(bbs[3], 0)) is phi)
+	assert (form.value_at(i, point(bbs[4], 0)) is phi)
+	assert (form.reaching_definition(s, point(bbs[3], 0)) is None)
+	feedback(True)
+
+	results = [run_function(f, {"msg.value": n}) for n in [0, 1, 4]]
+	assert (results == [[0, 0], [0, 1], [6, 4]])
+	optimize_flattened(f)
+	assert ([run_function(f, {"msg.value": n}) for n in [0, 1, 4]] ==
+			results)
+	feedback(True)
+	print("")
+
+def test_bb_merging():
+	sys.stdout.write("bb merging: ")
+	deltas = {1: 2, 2: -1, 3: 3, 4: -2, 5: 1}
+
+	def chain_function(edges):
+		# every BB k moves sp by deltas[k] and reads and writes stack slots
+		# around sp
+		f = make_function(edges)
+		for bb in f.nodes():
+			k = bb.address
+			bb.sp_delta = deltas[k]
+			bb.append_instruction(hlir.make_assign(expr.Stack(k),
+				expr.Add(expr.Stack(-k), expr.Lit(k))))
+			bb.append_instruction(hlir.make_assign(expr.Stack(0),
+				expr.Stack(1 - k)))
+		return f
+
+	def merge_pairwise(bb, succ):
+		# how blocks were merged before merge_chain
+		bb.terminator = None
+		bb.adjust_sp_delta(succ.sp_delta)
+		for ins in succ.get_instructions():
+			bb.append_instruction(ins)
+		bb.terminator = succ.terminator
+		for ss in list(succ.get_successors()):
+			bb.add_successor(ss)
+			succ.remove_successor(ss)
+		bb.remove_successor(succ)
+
+	# a chain of five blocks is merged into the first one at once, with the
+	# same stack offsets as merging one block after another
+	edges = [(1, 2), (2, 3), (3, 4), (4, 5)]
+	f, expected = chain_function(edges), chain_function(edges)
+	otheranalyses.BBMerging(None).optimize(f)
+	bbs = dict((bb.address, bb) for bb in expected.nodes())
+	for a in [2, 3, 4, 5]:
+		merge_pairwise(bbs[1], bbs[a])
+	assert ([bb.address for bb in f.nodes()] == [1])
+	bb = f.header_node
+	assert (bb.sp_delta == bbs[1].sp_delta == sum(deltas.values()))
+	assert ([str(ins) for ins in bb.get_instructions()] ==
+			[str(ins) for ins in bbs[1].get_instructions()])
+	assert (bb.terminator.type == hlir.ins_types.ret)
+	feedback(True)
+
+	# blocks with several predecessors or successors end a chain: 1
+	# branches, and 3 can be reached from 2 and 5, so only 4 is merged
+	f = chain_function([(1, 2), (2, 3), (3, 4), (1, 5), (5, 3)])
+	otheranalyses.BBMerging(None).optimize(f)
+	bbs = dict((bb.address, bb) for bb in f.nodes())
+	assert (sorted(bbs) == [1, 2, 3, 5])
+	assert (bbs[3].sp_delta == deltas[3] + deltas[4])
+	assert (len(bbs[3].get_instructions()) == 4)
+	assert (list(bbs[2].get_successors()) == [bbs[3]])
+	assert (sorted(p.address for p in bbs[3].get_predecessors()) == [2, 5])
+	feedback(True)
+	print("")
+
+def test_value_numbering():
+	sys.stdout.write("value numbering: ")
+	sender = expr.GlobalVar("msg.sender")
+
+	def value_numbering(f, flattened=False):
+		f.flattened = flattened
+		vn = propagation.ValueNumbering(None)
+		vn.optimize(f)
+		return vn.changed
+
+	def bb_with(instrs):
+		# BB 1 of a function 1 -> 2
+		f = make_function([(1, 2)])
+		bb = f.header_node
+		for ins in instrs:
+			bb.append_instruction(ins)
+		return f, bb
+
+	def asserted(ins):
+		# e for assert(e == k)
+		return ins.args[0].operand1
+
+	def x():
+		# size 3, so 3 occurrences are worth a variable, but not 2
+		return expr.Add(sender, expr.Lit(1))
+
+	def check(k, e):
+		return hlir.make_assertion(expr.Eq(e, expr.Lit(k)))
+
+	# the size threshold
+	f, bb = bb_with([check(1, x()), check(2, x())])
+	assert (not value_numbering(f))
+	assert (isinstance(asserted(bb.get_instructions()[0]), expr.Add))
+	feedback(True)
+
+	f, bb = bb_with([check(1, x()), check(2, x()),
+					 check(3, expr.Add(expr.Lit(1), sender))])
+	assert (value_numbering(f))
+	instrs = bb.get_instructions()
+	assert (len(instrs) == 4 and instrs[0].type == hlir.ins_types.assign)
+	var = instrs[0].results[0]
+	assert (isinstance(var, expr.Var) and var.pinned)
+	assert (isinstance(instrs[0].args[0], expr.Add))
+	assert (all(asserted(ins) is var for ins in instrs[1:]))
+	feedback(True)
+
+	# a variable already assigned the value is reused, and a variable
+	# bound earlier which now copies it is unpinned, so that propagation
+	# removes the copy
+	w, u = expr.Var(), expr.Var()
+	u.pinned = True
+	f, bb = bb_with([hlir.make_assign(w, x()), check(1, x()),
+					 hlir.make_assign(u, x())])
+	assert (value_numbering(f))
+	instrs = bb.get_instructions()
+	assert (len(instrs) == 3 and isinstance(instrs[0].args[0], expr.Add))
+	assert (w.pinned and asserted(instrs[1]) is w)
+	assert (instrs[2].results[0] is u and instrs[2].args[0] is w)
+	assert (not u.pinned)
+	feedback(True)
+
+	# occurrences in the branches of a diamond don't dominate each other,
+	# until there is one in the BB which dominates them all
+	def diamond(header_instrs):
+		f = make_function([(1, 2), (1, 3), (2, 4), (3, 4)])
+		bbs = dict((bb.address, bb) for bb in f.nodes())
+		for ins in header_instrs:
+			bbs[1].append_instruction(ins)
+		for a in [2, 3, 4]:
+			bbs[a].append_instruction(check(a, x()))
+		return f, bbs
+
+	f, bbs = diamond([])
+	assert (not value_numbering(f, flattened=True))
+	feedback(True)
+
+	f, bbs = diamond([check(1, x())])
+	assert (value_numbering(f, flattened=True))
+	var = bbs[1].get_instructions()[0].results[0]
+	assert (asserted(bbs[1].get_instructions()[1]) is var)
+	for a in [2, 3, 4]:
+		assert (asserted(bbs[a].get_instructions()[0]) is var)
+	feedback(True)
+
+	# volatile values and memory reads across a memory write are different
+	# values each time
+	gas = lambda: expr.Add(expr.GlobalVar("msg.gas"), expr.Lit(1))
+	f, bb = bb_with([check(1, gas()), check(2, gas()), check(3, gas())])
+	assert (not value_numbering(f))
+	feedback(True)
+
+	mem = lambda: expr.Add(expr.Mem(expr.Lit(0), expr.Lit(0x20)),
+						   expr.Lit(1))
+	write = hlir.make_assign(expr.Mem(expr.Lit(0), expr.Lit(0x20)),
+							 expr.Lit(5))
+	f, bb = bb_with([check(1, mem()), check(2, mem()), write,
+					 check(3, mem())])
+	assert (value_numbering(f))
+	instrs = bb.get_instructions()
+	var = instrs[0].results[0]
+	assert (asserted(instrs[1]) is var and asserted(instrs[2]) is var)
+	assert (isinstance(asserted(instrs[4]), expr.Add))
+	feedback(True)
+
+	# a definition inside another one is made first
+	y = lambda: expr.Mul(x(), expr.Lit(3))
+	f, bb = bb_with([check(1, y()), check(2, y()), check(3, y()),
+					 check(4, x()), check(5, x())])
+	assert (value_numbering(f))
+	instrs = bb.get_instructions()
+	inner, outer = instrs[0].results[0], instrs[1].results[0]
+	assert (isinstance(instrs[0].args[0], expr.Add))
+	assert (instrs[1].args[0].operand1 is inner)
+	assert (all(asserted(ins) is outer for ins in instrs[2:5]))
+	assert (all(asserted(ins) is inner for ins in instrs[5:]))
+	feedback(True)
+
+	# when the first occurrence is in the terminator, the definitions go
+	# after the other instructions of its BB
+	f = make_function([(1, 2), (1, 3)])
+	bbs = dict((bb.address, bb) for bb in f.nodes())
+	bbs[1].append_instruction(write)
+	bbs[1].terminator = hlir.make_jcond(expr.Lit(2),
+										expr.Eq(y(), expr.Lit(1)))
+	for k in [2, 3]:
+		bbs[2].append_instruction(check(k, y()))
+		bbs[2].append_instruction(check(k, x()))
+	assert (value_numbering(f, flattened=True))
+	instrs = bbs[1].get_instructions()
+	assert (len(instrs) == 3 and instrs[0] is write)
+	inner, outer = instrs[1].results[0], instrs[2].results[0]
+	assert (instrs[2].args[0].operand1 is inner)
+	assert (bbs[1].terminator.args[0].operand1 is outer)
+	feedback(True)
+	print("")
+
+def test_result_cache():
+	sys.stdout.write("result cache: ")
+	directory = tempfile.mkdtemp()
+	try:
+		c = cache.ResultCache(directory, "1")
+
+		# a round-trip; clones which only differ in their swarm hash share
+		# an entry
+		clone1 = "\x60\x01\x56\x00" + "\x11" * 32
+		clone2 = "\x60\x01\x56\x00" + "\x22" * 32
+		key = c.make_key(clone1)
+		assert (c.get(key) is None)
+		c.put(key, {"code": "foo"})
+		assert (c.make_key(clone2) == key)
+		assert (c.get(c.make_key(clone2)) == {"code": "foo"})
+		assert ((c.hits, c.misses) == (1, 1))
+		feedback(True)
+
+		# other versions and settings which change the output make other
+		# keys, and entries of another version or key are misses
+		assert (cache.ResultCache(directory, "2").make_key(clone1) != key)
+		pretty_ast = settings.pretty_ast
+		settings.pretty_ast = not pretty_ast
+		assert (c.make_key(clone1) != key)
+		settings.pretty_ast = pretty_ast
+		assert (c.make_key(clone1) == key)
+
+		with open(c.entry_path(key), "w") as f:
+			json.dump({"key": key, "version": "2", "result": "bar"}, f)
+		assert (c.get(key) is None)
+		with open(c.entry_path(key), "w") as f:
+			json.dump({"key": "0" * 64, "version": "1", "result": "bar"}, f)
+		assert (c.get(key) is None)
+		feedback(True)
+
+		# a corrupt entry is removed
+		with open(c.entry_path(key), "w") as f:
+			f.write("{\"key\": ")
+		assert (c.get(key) is None)
+		assert (not os.path.exists(c.entry_path(key)))
+		feedback(True)
+
+		# eviction removes the least recently used entries until the cache
+		# is below the watermark
+		keys = [c.make_key(chr(i) * 40) for i in range(10)]
+		for i, k in enumerate(keys):
+			c.put(k, "x" * 100)
+			os.utime(c.entry_path(k), (1000 + i, 1000 + i))
+		entry_size = os.path.getsize(c.entry_path(keys[0]))
+		assert (c.evict() == 0)
+		assert (c.get(keys[0]) is not None)
+		c.max_size = 5 * entry_size
+		assert (c.evict() == 6)
+		remaining = [k for k in keys if os.path.exists(c.entry_path(k))]
+		assert (remaining == [keys[0]] + keys[7:])
+		assert (len(remaining) * entry_size <=
+				c.max_size * cache.EVICTION_WATERMARK)
+		feedback(True)
+
+		# a hit doesn't report the phases of the run which filled the cache
+		bytecode, _ = utils.parse_json(JSON_PATH + "Minimal.json")
+		d = decompiler.Decompiler()
+		code, cached = d.decompile_cached(bytecode, c)
+		assert (not cached and "phases" in d.stats)
+		assert (not d.stats.get("cached"))
+		d = decompiler.Decompiler()
+		assert (d.decompile_cached(bytecode, c) == (code, True))
+		assert ("phases" not in d.stats and d.stats["cached"])
+		feedback(True)
+	finally:
+		shutil.rmtree(directory)
+	print("")
+
+def test_batch():
+	sys.stdout.write("batch: ")
+	directory = tempfile.mkdtemp()
+	timeout, worker_cache = batch.worker_timeout, batch.worker_cache
+	try:
+		def write(name, contents):
+			path = os.path.join(directory, name)
+			if not os.path.isdir(os.path.dirname(path)):
+				os.makedirs(os.path.dirname(path))
+			with open(path, "w") as f:
+				f.write(contents)
+			return path
+
+		minimal = write("sub/Minimal.json",
+			utils.read_file_contents(JSON_PATH + "Minimal.json"))
+		broken = write("broken.bc", "not hex")
+		write("notes.txt", "")
+		manifest = write("manifest", "# contracts\n\nsub/Minimal.json\n")
+
+		# directories are walked in order, other files are skipped, and
+		# every file is only listed once
+		assert (batch.collect_files([directory]) == [broken, minimal])
+		assert (batch.collect_files([manifest, minimal, directory]) ==
+				[minimal, broken])
+		assert (batch.collect_files([os.path.join(directory, "*.bc")]) ==
+				[broken])
+		feedback(True)
+
+		batch.worker_timeout = 0
+		batch.worker_cache = None
+		record = batch.decompile_file(minimal)
+		assert (record["filename"] == minimal and "cached" not in record)
+		success = record["success"]
+		assert (success["num_funcs"] == len(success["goto_func_complexities"])
+				+ len(success["other_func_complexities"]))
+		assert (len(success["phases"]) != 0)
+		record = batch.decompile_file(broken)
+		assert ("failure" in record and "success" not in record)
+		feedback(True)
+
+		# with a cache, the second run is a hit without phase timings
+		batch.worker_cache = cache.ResultCache(
+			os.path.join(directory, "cache"), decompiler.PIPELINE_VERSION)
+		first = batch.decompile_file(minimal)
+		second = batch.decompile_file(minimal)
+		assert (not first["cached"] and second["cached"])
+		assert (first["success"]["output"] == second["success"]["output"])
+		assert (second["success"]["phases"] == [])
+		feedback(True)
+
+		out = StringIO.StringIO()
+		assert (batch.run([minimal, broken], out, 1, 0) == (1, 1))
+		records = [json.loads(l) for l in out.getvalue().splitlines()]
+		assert (sorted(r["filename"] for r in records) == [broken, minimal])
+		feedback(True)
+	finally:
+		batch.worker_timeout, batch.worker_cache = timeout, worker_cache
+		shutil.rmtree(directory)
+	print("")
+
 # for printing our unit tests so we can use it in our report..
 #total_num_tests = 0
 #class Tester:
@@ -181,6 +970,18 @@ def pack_string_ref(s):
 
 def run_all_tests():
 
+	test_function_memo()
+	test_memalias()
+	test_consteval()
+	test_dominance()
+	test_numbering()
+	test_loop_structuring()
+	test_ssa()
+	test_bb_merging()
+	test_value_numbering()
+	test_result_cache()
+	test_batch()
+
 	tester = Tester("Minimal.json", [])
 	tester.add_test([0xc2985578], [0x123])
 	tester.add_except_test([0xdeadc0de], 
@@ -80,43 +80,113 @@ def signed(value):
 		value -= (1 << 256)
 	return value
 	
+# the expression visitors below are iterative, so that deeply nested
+# expressions don't hit the recursion limit. visit_and_modify and visit call
+# func in post-order, from left to right.
+
+def post_order(node):
+	# returns [(node, parent, key)] in post-order, where parent[key] or
+	# parent.key holds the node. The root comes last, with parent None.
+	# Walking in pre-order while pushing the children from left to right,
+	# and then reversing, gives a left-to-right post-order.
+	order = []
+	stack = [(node, None, None)]
+	while len(stack) != 0:
+		entry = stack.pop()
+		order.append(entry)
+		n = entry[0]
+		for attr in n.child_names:
+			child = getattr(n, attr)
+			if child.__class__ is list:
+				for i in range(len(child)):
+					stack.append((child[i], child, i))
+			else:
+				assert (child is not n)
+				stack.append((child, n, attr))
+	order.reverse()
+	return order
+
 def visit_and_modify(node, func, exclude=False):
-	for attr in node.child_names:
-		child_node = getattr(node, attr)
-		assert (child_node != node)
-		if isinstance(child_node, list):
-			for i in range(len(child_node)):
-				child_node[i] = visit_and_modify(child_node[i], func)
+	# replaces every node below node by what func returns for it, and
+	# returns what func returns for node itself. With exclude, func isn't
+	# called on node and None is returned.
+	names = node.child_names
+	if len(names) != 0:
+		shallow = True
+		for attr in names:
+			child = getattr(node, attr)
+			if child.__class__ is list or len(child.child_names) != 0:
+				shallow = False
+				break
+
+		if shallow:
+			# most expressions are like (var0 + 0x20)
+			for attr in names:
+				child = getattr(node, attr)
+				new = func(child)
+				if new is not child:
+					setattr(node, attr, new)
 		else:
-			new_child_node = visit_and_modify(child_node, func)
-			setattr(node, attr, new_child_node)
+			order = post_order(node)
+			order.pop()
+			for n, parent, key in order:
+				new = func(n)
+				if new is n:
+					continue
+				if parent.__class__ is list:
+					parent[key] = new
+				else:
+					setattr(parent, key, new)
 
 	if not exclude:
 		return func(node)
 
+def visit(node, func, exclude=False):
+	# like visit_and_modify, for callbacks which don't replace anything; what
+	# func returns is ignored. Without parents to keep track of, the
+	# pre-order walk only needs the nodes.
+	if len(node.child_names) != 0:
+		order = []
+		stack = [node]
+		while len(stack) != 0:
+			n = stack.pop()
+			order.append(n)
+			for attr in n.child_names:
+				child = getattr(n, attr)
+				if child.__class__ is list:
+					stack.extend(child)
+				else:
+					stack.append(child)
+		for i in range(len(order) - 1, 0, -1):
+			func(order[i])
+
+	if not exclude:
+		func(node)
 
-# NOTE: if two expressions compare equal but have different ids then this will
-# only retrieve one of them!!!
 def visit_expr(e, exclude=False):
+	# returns every distinct expression object in e. Variables and literals
+	# are shared, so they're only returned once.
+	result = []
+	seen = set()
+	stack = [e]
+	while len(stack) != 0:
+		n = stack.pop()
+		if id(n) in seen:
+			continue
+		seen.add(id(n))
+		result.append(n)
+		for attr in n.child_names:
+			child = getattr(n, attr)
+			if child.__class__ is list:
+				stack += child
+			else:
+				assert (child is not n)
+				stack.append(child)
+
 	if exclude:
-		result = []
-	else:
-		result = [e]
-	
-	for attr in e.child_names:
-		child_node = getattr(e, attr)
-		assert (child_node != e)
-		if isinstance(child_node, list):
-			for item in child_node:
-				r = visit_expr(item)
-				assert (e not in r)
-				result += r
-		else:
-			r = visit_expr(child_node)
-			assert (not any(id(e) == id(x) for x in r))
-			result += r
-	
-	return {id(e): e for e in result}.values()
+		# the root always comes first
+		del result[0]
+	return result
 
 def visit_and_modify_instruction(ins, func, exclude_lhs=False):
 	for i in range(len(ins.args)):
@@ -129,6 +199,15 @@ def visit_and_modify_instruction(ins, func, exclude_lhs=False):
 	if isinstance(ins.loc, expr.Expression):
 		ins.loc = visit_and_modify(ins.loc, func)
 
+def visit_instruction(ins, func, exclude_lhs=False):
+	# the read-only counterpart of visit_and_modify_instruction
+	for arg in ins.args:
+		visit(arg, func)
+	for res in ins.results:
+		visit(res, func, exclude_lhs)
+	if isinstance(ins.loc, expr.Expression):
+		visit(ins.loc, func)
+
 def pairs(l):
 	i = 0
 	while i < len(l) - 1:
@@ -188,6 +267,11 @@ def visit_and_modify_expressions(node, func, exclude_lhs=False):
 
 	return result[0]
 
+def visit_expressions(node, func, exclude_lhs=False):
+	# the read-only counterpart of visit_and_modify_expressions
+	for ins in node.get_instructions() + [node.terminator]:
+		visit_instruction(ins, func, exclude_lhs)
+
 def dfs_ordering(node):
 	result = []
 	seen = set()
@@ -202,30 +286,85 @@ def dfs_ordering(node):
 		result.append(n)
 	return result
 
+def strongly_connected_components(roots, follow):
+	# Tarjan's algorithm, without recursion. Returns the SCCs of the nodes
+	# reachable from roots via follow, as lists. Every SCC comes after the
+	# SCCs reachable from it.
+	index = {}
+	low = {}
+	on_stack = set()
+	stack = []
+	result = []
+	for root in roots:
+		if root in index:
+			continue
+		index[root] = low[root] = len(index)
+		stack.append(root)
+		on_stack.add(root)
+		work = [(root, iter(follow(root)))]
+		while len(work) != 0:
+			node, succs = work[-1]
+			for s in succs:
+				if s not in index:
+					index[s] = low[s] = len(index)
+					stack.append(s)
+					on_stack.add(s)
+					work.append((s, iter(follow(s))))
+					break
+				if s in on_stack:
+					low[node] = min(low[node], index[s])
+			else:
+				work.pop()
+				if len(work) != 0:
+					parent = work[-1][0]
+					low[parent] = min(low[parent], low[node])
+				if low[node] == index[node]:
+					scc = []
+					while True:
+						n = stack.pop()
+						on_stack.remove(n)
+						scc.append(n)
+						if n is node:
+							break
+					result.append(scc)
+	return result
+
 def sha3(text):
 	h = keccak_256()
 	h.update(text)
 	return int("0x" + h.hexdigest(), 16)
 
-def compute_indirect_jump_successors(all_nodes, subset=None):
-	if subset is None:
-		subset = all_nodes
-
+def jump_target_addresses(nodes):
+	# address -> node, for the nodes an indirect jump may go to
 	valid_addresses = {}
-	for node in all_nodes:
+	for node in nodes:
 		# do not include the node with address 0, nor those with None
 		if node.address:
 			valid_addresses[node.address] = node
+	return valid_addresses
+
+def pushed_jump_targets(node, valid_addresses):
+	# the nodes whose addresses are assigned somewhere in node, which an
+	# indirect jump may then go to
+	result = set()
+	for ins in node.get_instructions():
+		if ins.type != hlir.ins_types.assign:
+			continue
+		for e in ins.args:
+			if (isinstance(e, expr.Lit) and 
+					e.literal in valid_addresses):
+				result.add(valid_addresses[e.literal])
+	return result
+
+def compute_indirect_jump_successors(all_nodes, subset=None):
+	if subset is None:
+		subset = all_nodes
+
+	valid_addresses = jump_target_addresses(all_nodes)
 
 	result = set()
 	for node in subset:
-		for ins in node.get_instructions():
-			if ins.type != hlir.ins_types.assign:
-				continue
-			for e in ins.args:
-				if (isinstance(e, expr.Lit) and 
-						e.literal in valid_addresses):
-					result.add(valid_addresses[e.literal])
+		result |= pushed_jump_targets(node, valid_addresses)
 	assert (len(result) != 0)
 	return result
 